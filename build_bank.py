@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="離線預先建置題庫（詞彙、綜合測驗、社會科），可中斷後續跑")
+    parser.add_argument('--output', default='question_bank.build.sqlite3', help="輸出的題庫檔案")
+    parser.add_argument('--checkpoint', default=None, help="進度檔（預設為 <output>.checkpoint.json）")
+    parser.add_argument('--subjects', default='vocabulary,comprehensive,social', help="要建置的項目，以逗號分隔")
+    parser.add_argument('--levels', default='1,2,3,4,5,6', help="詞彙題的級別，以逗號分隔")
+    parser.add_argument('--vocab-batch', type=int, default=10, help="每次請求生成的單字數")
+    parser.add_argument('--social-per-item', type=int, default=2, help="每個課綱條目生成的社會科題數")
+    parser.add_argument('--cloze', type=int, default=200, help="綜合測驗題組的目標份數")
+    parser.add_argument('--workers', type=int, default=4, help="同時進行的生成工作數")
+    parser.add_argument('--rpm', type=float, default=30.0, help="每分鐘最多開始的生成工作數（依 Gemini 配額調整）")
+    parser.add_argument('--retries', type=int, default=3, help="每個工作失敗後的重試次數")
+    parser.add_argument('--timeout', type=float, default=120.0, help="單一工作的逾時秒數")
+    parser.add_argument('--limit', type=int, default=0, help="本次最多執行幾個工作（0 為不限，方便試跑）")
+    parser.add_argument('--vocabulary-path', default='學測6000字.csv')
+    parser.add_argument('--curriculum-path', default='高中必修社會課綱.csv')
+    return parser.parse_args()
+
+
+Job = Tuple[str, Callable[[], Awaitable[int]]]
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.version: Optional[str] = None
+        self.done: Set[str] = set()
+        self.failed: Dict[str, int] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.version = data.get('version')
+            self.done = set(data.get('done', []))
+            self.failed = dict(data.get('failed', {}))
+
+    def save(self):
+        # 先寫暫存檔再換名，中斷時不會留下寫到一半的進度檔
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'done': sorted(self.done), 'failed': self.failed}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def complete(self, job_id: str):
+        self.done.add(job_id)
+        self.failed.pop(job_id, None)
+        self.save()
+
+    def fail(self, job_id: str):
+        self.failed[job_id] = self.failed.get(job_id, 0) + 1
+        self.save()
+
+
+def _job_id(prefix: str, words: List[str]) -> str:
+    return f"{prefix}:{hashlib.sha1(','.join(words).encode('utf-8')).hexdigest()[:12]}"
+
+
+def _require(questions: List[Dict]) -> List[Dict]:
+    # 生成函式在請求或解析失敗時回傳空清單，這裡轉成錯誤，與「全部和題庫重複」區分開來
+    if not questions:
+        raise ValueError("模型沒有產生可用的題目")
+    return questions
+
+
+def _vocabulary_jobs(args, bank) -> List[Job]:
+    import english
+    from vocabulary import load_vocabulary
+
+    store = load_vocabulary(args.vocabulary_path)
+    # 生成時的單字比對與分級都以 english 的單字表為準，改用這次指定的單字表
+    english._vocabulary.set(store)
+    levels = {int(lv) for lv in args.levels.split(',') if lv.strip()}
+    # 題庫裡已經有題目的單字不再生成，可直接沿用白天累積的題庫
+    existing = bank.targets('vocabulary')
+    jobs: List[Job] = []
+    for level in sorted(levels):
+        words = [v for entry in store.by_level.get(level, ()) for v in entry.variants if v.lower() not in existing]
+        for start in range(0, len(words), max(1, args.vocab_batch)):
+            batch = words[start:start + args.vocab_batch]
+
+            async def run(batch=batch) -> int:
+                # 等寫入完成再回傳實際新增的題數，全部重複時才能與其他項目一樣計為重複
+                data = _require(await english.generate_questions(batch, timeout=args.timeout, command='build', store=False))
+                return await english._save_vocabulary_questions(data)
+
+            jobs.append((_job_id(f"vocabulary:{level}", batch), run))
+    return jobs
+
+
+def _comprehensive_jobs(args, bank) -> List[Job]:
+    import english
+
+    async def run() -> int:
+        data = _require(await english._request_comprehensive(timeout=args.timeout))
+        return await bank.call(bank.add, 'comprehensive', '', data)
+
+    return [(f"comprehensive:{i}", run) for i in range(args.cloze)]
+
+
+def _social_jobs(args, bank) -> List[Job]:
+    import social
+    from curriculum import load_curriculum
+
+    curriculum = load_curriculum(args.curriculum_path)
+    social._curriculum.set(curriculum)
+    jobs: List[Job] = []
+    for index, item in enumerate(curriculum.items):
+        async def run(item=item) -> int:
+            data = _require(await social._generate_questions([str(item)], args.social_per_item, timeout=args.timeout))
+            return await bank.call(bank.add, 'social', item.subject, data)
+
+        jobs.append((f"social:{index}:{item.subject}{item.code}", run))
+    return jobs
+
+
+class Builder:
+    def __init__(self, args, checkpoint: Checkpoint):
+        from rate_limiter import TokenBucket
+
+        self.args = args
+        self.checkpoint = checkpoint
+        self._bucket = TokenBucket(args.rpm / 60.0, max(1, args.workers))
+        self._pause_until = 0.0
+        self._backoff = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.added = 0
+        self.duplicates = 0
+        self.total = 0
+        self.started = time.monotonic()
+
+    async def _admit(self):
+        # 依每分鐘上限放行；模型連續失敗（多半是配額用盡）時全部工作一起暫停
+        while True:
+            wait = self._pause_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if self._bucket.try_take():
+                return
+            await asyncio.sleep(max(self._bucket.retry_after(), 0.05))
+
+    def _report(self):
+        elapsed = time.monotonic() - self.started
+        finished = self.completed + self.failed
+        rate = finished / elapsed if elapsed else 0.0
+        eta = (self.total - finished) / rate if rate else 0.0
+        print(f"[{finished}/{self.total}] 新增 {self.added} 題　全部重複 {self.duplicates}　失敗 {self.failed}　{rate * 60:.1f} 工作/分　預估剩餘 {eta / 60:.1f} 分")
+
+    async def _worker(self, queue: 'asyncio.Queue[Job]'):
+        while True:
+            try:
+                job_id, run = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for attempt in range(self.args.retries + 1):
+                await self._admit()
+                try:
+                    added = await asyncio.wait_for(run(), timeout=self.args.timeout)
+                except Exception as e:
+                    # 只有請求或解析失敗才退避；生成成功但全部與題庫重複不代表配額有問題
+                    print(f"{job_id} 發生錯誤: {e!r}")
+                    self._backoff = min(max(self._backoff * 2, 5.0), 300.0)
+                    self._pause_until = max(self._pause_until, time.monotonic() + self._backoff)
+                    continue
+                self._backoff = 0.0
+                self.added += added
+                if not added:
+                    self.duplicates += 1
+                self.completed += 1
+                self.checkpoint.complete(job_id)
+                break
+            else:
+                self.failed += 1
+                self.checkpoint.fail(job_id)
+            if (self.completed + self.failed) % 10 == 0:
+                self._report()
+
+    async def run(self, jobs: List[Job]):
+        queue: 'asyncio.Queue[Job]' = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        self.total = len(jobs)
+        await asyncio.gather(*(self._worker(queue) for _ in range(max(1, self.args.workers))))
+        self._report()
+
+
+async def _main(args):
+    from gemini_client import get_client
+    from question_bank import get_bank
+    from token_usage import token_usage
+
+    # 建置工具以 --rpm 自行控制速率，不經過機器人的全域限流
+    get_client().limiter = None
+    bank = get_bank()
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint.json")
+    if checkpoint.version is None:
+        checkpoint.version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        checkpoint.save()
+    bank.set_meta('build_version', checkpoint.version)
+    builders = {'vocabulary': _vocabulary_jobs, 'comprehensive': _comprehensive_jobs, 'social': _social_jobs}
+    jobs: List[Job] = []
+    for subject in [s.strip() for s in args.subjects.split(',') if s.strip()]:
+        if subject not in builders:
+            raise SystemExit(f"未知的建置項目：{subject}")
+        jobs += [job for job in builders[subject](args, bank) if job[0] not in checkpoint.done]
+    if args.limit:
+        jobs = jobs[:args.limit]
+    print(f"題庫版本 {checkpoint.version}：已完成 {len(checkpoint.done)} 個工作，本次執行 {len(jobs)} 個")
+    builder = Builder(args, checkpoint)
+    await builder.run(jobs)
+    # 經由題庫的背景執行緒查詢，確保先前送出的寫入都已完成
+    counts = {subject: await bank.call(bank.count, subject) for subject in builders}
+    await bank.call(bank.set_meta, 'build_counts', json.dumps(counts, ensure_ascii=False))
+    if not builder.failed and not args.limit:
+        await bank.call(bank.set_meta, 'build_completed_at', datetime.now(timezone.utc).isoformat())
+    print(f"題庫題數：{counts}")
+    for (subject, command), usage in token_usage.top(5):
+        print(f"token 用量 {subject}/{command}：輸入 {usage['input']}　輸出 {usage['output']}")
+    print(f"完成後將 QUESTION_BANK_PATH 指向 {args.output}（或替換原本的題庫檔）即可讓機器人使用")
+
+
+def main():
+    args = _parse_args()
+    # 必須在載入題庫模組前設定，get_bank() 會讀取這個環境變數
+    os.environ['QUESTION_BANK_PATH'] = args.output
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import csv
+import os
+import random
+import re
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+
+SUBJECT_NAMES = {'歷': '歷史', '地': '地理', '公': '公民'}
+EXTENSION_TAG = '【延伸探究】'
+_ITEM_PATTERN = re.compile(r'^(歷|地|公)\s+([A-Za-z]+-V-\d+)\s*(.*)$')
+
+
+class CurriculumItem:
+    __slots__ = ('subject', 'code', 'theme', 'text', 'extension')
+
+    def __init__(self, subject: str, code: str, text: str, extension: bool = False):
+        self.subject = subject
+        self.code = code
+        self.theme = code.split('-', 1)[0]
+        self.text = text
+        self.extension = extension
+
+    def __str__(self) -> str:
+        if self.extension:
+            return f"{self.subject} {self.code} {EXTENSION_TAG}{self.text}"
+        return f"{self.subject} {self.code} {self.text}"
+
+
+class Curriculum:
+    def __init__(self, items: Iterable[CurriculumItem], recent_size: int = 30):
+        self.items: List[CurriculumItem] = list(items)
+        self.by_subject: Dict[str, List[int]] = {}
+        self.by_theme: Dict[Tuple[str, str], List[int]] = {}
+        self._themes: Dict[Optional[str], List[Tuple[str, str]]] = {None: []}
+        for index, item in enumerate(self.items):
+            self.by_subject.setdefault(item.subject, []).append(index)
+            key = (item.subject, item.theme)
+            if key not in self.by_theme:
+                self.by_theme[key] = []
+                self._themes.setdefault(item.subject, []).append(key)
+                self._themes[None].append(key)
+            self.by_theme[key].append(index)
+        self._uses = [0] * len(self.items)
+        self._theme_uses: Dict[Tuple[str, str], int] = {key: 0 for key in self.by_theme}
+        self._recent: Deque[int] = deque(maxlen=max(0, min(recent_size, len(self.items) // 2)))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __bool__(self) -> bool:
+        return bool(self.items)
+
+    def has_subject(self, subject: Optional[str]) -> bool:
+        return subject is None or bool(self.by_subject.get(subject))
+
+    def sample(self, count: int, subject: Optional[str] = None) -> List[CurriculumItem]:
+        themes = list(self._themes.get(subject, ()))
+        if not themes or count <= 0:
+            return []
+        # 先挑使用次數最少的主題，讓出題範圍平均涵蓋整份課綱
+        random.shuffle(themes)
+        themes.sort(key=lambda key: self._theme_uses[key])
+        picked: List[int] = []
+        recent = set(self._recent)
+        available = len(self.by_subject.get(subject, ())) if subject else len(self.items)
+        target = min(count, available)
+        while len(picked) < target:
+            for key in themes:
+                candidates = [idx for idx in self.by_theme[key] if idx not in picked]
+                if not candidates:
+                    continue
+                fresh = [idx for idx in candidates if idx not in recent] or candidates
+                best = min(self._uses[idx] for idx in fresh)
+                picked.append(random.choice([idx for idx in fresh if self._uses[idx] == best]))
+                if len(picked) >= target:
+                    break
+        for index in picked:
+            self._uses[index] += 1
+            self._theme_uses[(self.items[index].subject, self.items[index].theme)] += 1
+            self._recent.append(index)
+        return [self.items[index] for index in picked]
+
+
+def parse_curriculum(rows: Iterable[List[str]]) -> List[CurriculumItem]:
+    items: List[CurriculumItem] = []
+    # 【延伸探究】沒有科別前綴，依所在欄位歸屬到該欄上一個條目
+    last_in_column: Dict[int, CurriculumItem] = {}
+    for row in rows:
+        for column, cell in enumerate(row):
+            cell = cell.strip()
+            if not cell:
+                continue
+            match = _ITEM_PATTERN.match(cell)
+            if match:
+                subject, code, text = match.groups()
+                # 少數儲存格把條目代碼與【延伸探究】寫在同一格，例如「公 Bc-V-2 【延伸探究】…」
+                text, _, extension = text.partition(EXTENSION_TAG)
+                item = CurriculumItem(subject, code, text.strip())
+                last_in_column[column] = item
+                if item.text:
+                    items.append(item)
+                if extension.strip():
+                    items.append(CurriculumItem(subject, code, extension.strip(), extension=True))
+            elif cell.startswith(EXTENSION_TAG) and column in last_in_column:
+                parent = last_in_column[column]
+                items.append(CurriculumItem(parent.subject, parent.code, cell[len(EXTENSION_TAG):].strip(), extension=True))
+    return items
+
+
+def load_curriculum(path: str = '高中必修社會課綱.csv') -> Curriculum:
+    if not os.path.exists(path):
+        return Curriculum([])
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return Curriculum(parse_curriculum(csv.reader(f)))
@@ -0,0 +1,134 @@
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+
+import discord
+
+
+TITLE_LIMIT = 256
+DESCRIPTION_LIMIT = 4096
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+FOOTER_LIMIT = 2048
+FIELDS_PER_EMBED = 25
+EMBED_TOTAL_LIMIT = 6000
+EMBEDS_PER_MESSAGE = 10
+# 頁碼與續頁標記預留的字數
+_PAGE_MARGIN = 32
+
+
+def _units(text: str, limit: int) -> Iterator[Tuple[str, str]]:
+    # 依段落、行、字元逐層切開，每個單位都不超過上限，並附上與前一個單位之間的分隔字串
+    for p_index, para in enumerate(text.split('\n\n')):
+        para_sep = '\n\n' if p_index else ''
+        if len(para) <= limit:
+            yield para_sep, para
+            continue
+        for l_index, line in enumerate(para.split('\n')):
+            line_sep = para_sep if l_index == 0 else '\n'
+            for start in range(0, max(len(line), 1), limit):
+                yield (line_sep if start == 0 else ''), line[start:start + limit]
+
+
+def chunk_text(text: str, limit: int = FIELD_VALUE_LIMIT) -> List[str]:
+    if not isinstance(text, str):
+        text = str(text)
+    if len(text) <= limit:
+        return [text]
+    chunks: List[str] = []
+    parts: List[str] = []
+    size = 0
+    for sep, unit in _units(text, limit):
+        if parts and size + len(sep) + len(unit) <= limit:
+            parts.append(sep)
+            parts.append(unit)
+            size += len(sep) + len(unit)
+            continue
+        if parts:
+            chunks.append(''.join(parts))
+        parts = [unit]
+        size = len(unit)
+    if parts:
+        chunks.append(''.join(parts))
+    return chunks
+
+
+TRUNCATED_MARK = "…（內容過長，已截斷）"
+
+
+def add_long_field(embed: discord.Embed, name: str, value: str, inline: bool = False):
+    # 單一 embed 的欄位數與總字數也有上限，放不下的部分截斷並標示，避免整則訊息被 Discord 拒絕
+    chunks = chunk_text(value or '—', FIELD_VALUE_LIMIT)
+    for index, chunk in enumerate(chunks):
+        field_name = (name if index == 0 else f"{name}（續）")[:FIELD_NAME_LIMIT]
+        room = min(FIELD_VALUE_LIMIT, EMBED_TOTAL_LIMIT - _PAGE_MARGIN - len(embed) - len(field_name))
+        slots = FIELDS_PER_EMBED - len(embed.fields)
+        if slots <= 0 or room <= len(TRUNCATED_MARK):
+            return
+        more = index + 1 < len(chunks)
+        if len(chunk) > room or (more and slots == 1):
+            embed.add_field(name=field_name, value=chunk[:room - len(TRUNCATED_MARK)] + TRUNCATED_MARK, inline=inline)
+            return
+        embed.add_field(name=field_name, value=chunk, inline=inline)
+
+
+class EmbedPaginator:
+    def __init__(self, title: str, color: int, description: str = ''):
+        self.title = title[:TITLE_LIMIT - _PAGE_MARGIN]
+        self.color = color
+        self.footer: Optional[str] = None
+        self._pages: List[discord.Embed] = []
+        self._size = 0
+        for chunk in chunk_text(description, DESCRIPTION_LIMIT) if description else []:
+            self._new_page(chunk)
+        if not self._pages:
+            self._new_page()
+
+    def _new_page(self, description: Optional[str] = None):
+        self._pages.append(discord.Embed(title=self.title, description=description, color=self.color))
+        self._size = len(self.title) + len(description or '')
+
+    def add_field(self, name: str, value: str, inline: bool = False):
+        budget = EMBED_TOTAL_LIMIT - FOOTER_LIMIT // 4 - _PAGE_MARGIN
+        for index, chunk in enumerate(chunk_text(value or '—', FIELD_VALUE_LIMIT)):
+            field_name = (name if index == 0 else f"{name}（續）")[:FIELD_NAME_LIMIT]
+            cost = len(field_name) + len(chunk)
+            page = self._pages[-1]
+            if len(page.fields) >= FIELDS_PER_EMBED or self._size + cost > budget:
+                self._new_page()
+                page = self._pages[-1]
+            page.add_field(name=field_name, value=chunk, inline=inline)
+            self._size += cost
+
+    def set_footer(self, text: str):
+        self.footer = text[:FOOTER_LIMIT // 4]
+
+    @property
+    def embeds(self) -> List[discord.Embed]:
+        total = len(self._pages)
+        for number, page in enumerate(self._pages, start=1):
+            if total > 1:
+                page.title = f"{self.title}（{number}/{total}）"
+            if self.footer and number == total:
+                page.set_footer(text=self.footer)
+        return self._pages
+
+
+def group_for_messages(embeds: List[discord.Embed]) -> List[List[discord.Embed]]:
+    # 同一則訊息內所有 embed 的總字數也不能超過 6000
+    groups: List[List[discord.Embed]] = []
+    current: List[discord.Embed] = []
+    size = 0
+    for embed in embeds:
+        length = len(embed)
+        if current and (len(current) >= EMBEDS_PER_MESSAGE or size + length > EMBED_TOTAL_LIMIT):
+            groups.append(current)
+            current, size = [], 0
+        current.append(embed)
+        size += length
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def send_embeds(send: Callable[..., Awaitable], embeds: List[discord.Embed]):
+    for group in group_for_messages(embeds):
+        await send(embeds=group)
@@ -1,33 +1,30 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import pandas as pd
-import random
-import json
+import asyncio
+import time
 from datetime import datetime, timedelta
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-
-def load_vocabulary() -> pd.DataFrame:
-    try:
-        df = pd.read_csv('學測6000字.csv')
-        df = df.dropna(subset=['單字', '級別'])
-        return df
-    except Exception as e:
-        print(f"載入單字資料時發生錯誤: {e}")
-        return pd.DataFrame()
-
-
-def init_gemini():
-    load_dotenv()
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError("請設定GEMINI_API_KEY環境變數")
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash-lite')
+from embed_pages import EmbedPaginator, add_long_field, send_embeds
+from gemini_client import get_client, interaction_timeout
+from llm_json import JSONArrayStream, parse_object, parse_questions
+from local_vocabulary import LocalQuestionBuilder
+from metrics import active_sessions, button_latency, first_question_latency
+from prefetch import PREFETCH_AHEAD, PREFETCH_TIMEOUT, Prefetcher
+from prompts import PromptTemplate, RenderedPrompt, register_template
+from question_bank import content_hash, get_bank, mark_seen
+from question_cache import WordQuestionCache
+from question_pipeline import generate_with_backfill, generation_budget, options_contain, question_problems
+from question_pool import QuestionPool
+from rate_limiter import QUEUE_TIMEOUT, RateLimited, admit, generation_limiter, send_rejection, send_status
+from review_scheduler import get_scheduler
+from resources import LazyResource, register_warmup
+from request_coalescer import RequestCoalescer, StreamCoalescer
+from session_store import SessionRejected, create_store
+from shard_metrics import shard_for
+from settings import env_float, env_int
+from vocabulary import VocabularyStore, load_vocabulary
 
 
 def _escape_md(text: str) -> str:
@@ -36,51 +33,27 @@ def _escape_md(text: str) -> str:
     return text.replace('_', '\\_')
 
 
-def _chunk_text(text: str, limit: int = 1024) -> List[str]:
-    if not isinstance(text, str):
-        return [str(text)]
-    if len(text) <= limit:
-        return [text]
-    chunks: List[str] = []
-    paragraphs = text.split('\n\n')
-    buffer = ''
-    for para in paragraphs:
-        candidate = para if not buffer else buffer + '\n\n' + para
-        if len(candidate) <= limit:
-            buffer = candidate
-        else:
-            if buffer:
-                chunks.append(buffer)
-                buffer = ''
-            lines = para.split('\n')
-            acc = ''
-            for line in lines:
-                cand2 = line if not acc else acc + '\n' + line
-                if len(cand2) <= limit:
-                    acc = cand2
-                else:
-                    if acc:
-                        chunks.append(acc)
-                        acc = ''
-                    line_text = line
-                    while len(line_text) > limit:
-                        chunks.append(line_text[:limit])
-                        line_text = line_text[limit:]
-                    acc = line_text
-            if acc:
-                chunks.append(acc)
-    if buffer:
-        chunks.append(buffer)
-    return chunks
-
-
-vocabulary_df = load_vocabulary()
-gemini_model = init_gemini()
+_vocabulary = LazyResource('vocabulary', load_vocabulary)
+
+
+def get_vocabulary() -> VocabularyStore:
+    return _vocabulary.get()
+
+
+_local_questions = LazyResource('local_vocabulary', lambda: LocalQuestionBuilder(get_vocabulary()))
+# 生成超過這個秒數還沒有題目時，改用單字表出題
+LOCAL_FALLBACK_AFTER = env_float('VOCAB_LOCAL_FALLBACK_AFTER', 8.0)
 
 
 class GameState:
-    def __init__(self, user_id: int, total_questions: int, level: Optional[int] = None):
+    __slots__ = (
+        'user_id', 'total_questions', 'level', 'current_question', 'selected_words', 'questions', 'score', 'start_time',
+        'generation_done', 'arrived', 'mode',
+    )
+
+    def __init__(self, user_id: int, total_questions: int, level: Optional[int] = None, mode: str = 'ai'):
         self.user_id = user_id
+        self.mode = mode
         self.total_questions = total_questions
         self.level = level
         self.current_question = 0
@@ -88,42 +61,184 @@ class GameState:
         self.questions: List[Dict] = []
         self.score = 0
         self.start_time = datetime.now()
+        self.generation_done = True
+        self.arrived: Optional[asyncio.Event] = None
 
+    def expect_more(self):
+        self.generation_done = False
+        self.arrived = asyncio.Event()
 
-user_games: Dict[int, object] = {}
+    def add_questions(self, questions: List[Dict]):
+        self.questions.extend(questions)
+        if self.arrived is not None:
+            self.arrived.set()
 
+    def finish_generation(self):
+        self.generation_done = True
+        # 補題後仍不足時縮短測驗，而不是讓使用者卡在不存在的題目
+        if len(self.questions) < self.total_questions:
+            self.total_questions = max(len(self.questions), 1)
+        if self.arrived is not None:
+            self.arrived.set()
 
-def select_words(df: pd.DataFrame, count: int, level: Optional[int] = None) -> List[str]:
-    if df.empty:
-        return []
-    filtered_df = df[df['級別'] == level] if level else df
-    if filtered_df.empty:
+    async def wait_for_question(self, index: int, timeout: float) -> Optional[Dict]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while index >= len(self.questions) and not self.generation_done:
+            self.arrived.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+        return self.questions[index] if index < len(self.questions) else None
+
+
+def _unique(questions: List[Dict], seen: set) -> List[Dict]:
+    picked = []
+    for q in questions:
+        word = str(q.get('單字', '')).strip().lower()
+        if word:
+            if word in seen:
+                continue
+            seen.add(word)
+        picked.append(q)
+    return picked
+
+
+def _fill_locally(game_state: GameState) -> int:
+    # 生成失敗、逾時或額度用盡時，沒有拿到題目的單字改由單字表直接出題
+    covered = {str(q.get('單字', '')).strip().lower() for q in game_state.questions}
+    words = [w for w in game_state.selected_words if w.strip().lower() not in covered]
+    questions = _local_questions.get().build(words)
+    if questions:
+        game_state.add_questions(questions)
+    return len(questions)
+
+
+_background_tasks = set()
+
+
+def _spawn(coro: Awaitable) -> asyncio.Task:
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _append_later(game_state: GameState, pending: Awaitable[List[Dict]]):
+    try:
+        game_state.add_questions(await pending)
+    except asyncio.TimeoutError:
+        print("生成題目逾時")
+    except Exception as e:
+        print(f"生成題目時發生錯誤: {e}")
+    finally:
+        _fill_locally(game_state)
+        game_state.finish_generation()
+
+
+async def _admitted_submit(interaction: discord.Interaction, words: List[str]) -> List[Dict]:
+    # 背景補題不顯示排隊訊息，額度不足時直接以現有題目進行
+    await generation_limiter.acquire(
+        interaction.user.id, interaction.guild_id, timeout=min(QUEUE_TIMEOUT, interaction_timeout(interaction))
+    )
+    try:
+        return await vocabulary_coalescer.submit(words, timeout=interaction_timeout(interaction))
+    finally:
+        # 合併批次只用掉觸發送出那一位的令牌，其他人的在這裡退回
+        generation_limiter.release_unused()
+
+
+async def _append_stream(game_state: GameState, stream: AsyncIterator[Dict]):
+    try:
+        async for question in stream:
+            game_state.add_questions([question])
+    except asyncio.TimeoutError:
+        print("生成題目逾時")
+    except Exception as e:
+        print(f"生成題目時發生錯誤: {e}")
+    finally:
+        generation_limiter.release_unused()
+        _fill_locally(game_state)
+        game_state.finish_generation()
+
+
+user_games = create_store('english')
+active_sessions.set_function(lambda: len(user_games), subject='english')
+
+
+def select_words(store: VocabularyStore, count: int, level: Optional[int] = None) -> List[str]:
+    return [entry.pick()[0] for entry in store.sample(count, level)]
+
+
+async def _review_words(user_id: int, count: int, level: Optional[int] = None) -> List[str]:
+    scheduler = get_scheduler()
+    try:
+        return await scheduler.call(scheduler.due, user_id, 'vocabulary', count, level)
+    except Exception as e:
+        print(f"讀取複習排程時發生錯誤: {e}")
         return []
-    selected = filtered_df.sample(n=min(count, len(filtered_df)), random_state=None)
-    words: List[str] = []
-    for word in selected['單字']:
-        if '/' in word:
-            word = random.choice(word.split('/'))
-        words.append(word)
-    return words
-
-
-def generate_question_prompt(words: List[str]) -> str:
-    words_str = '、'.join(words)
-    return f"""你是一個英文科測驗命題者，你的任務是為台灣的大學學測（GSAT）出題。要測試用戶是否學會這幾個單字：{words_str}，請你依照學測大考中心的宗旨和難度出題並提供答案和解析，每一個單字只需要出一題，並請確保每個題目只有四個選項，而且所有題目的正確答案的選項位置是隨機分布無規律。選項必須符合台灣學測程度，所有題目的所有選項列出來看都應該獨一無二，依照該題情境所選擇。正確選項必須是唯一完全符合文意的選項，錯誤選項必須符合詞性但是放入後會造成語意錯誤或不自然或與題幹衝突或不合理或不符合語境。
-請以json格式回答並且只需要題號、題目、選項、答案、詳解欄位，其他一概不需要，詳解請用繁體中文表達。以下為你應該遵照的json格式，詳解部分不一定要按照這個格式。
- {{
+
+
+async def _cached_unseen(user_id: int, words: List[str]) -> Tuple[List[Dict], List[str]]:
+    # 一次查出快取中這位使用者看過的版本，避免逐題查詢題庫
+    variants = vocabulary_cache.variants(words)
+    seen = set()
+    if variants:
+        bank = get_bank()
+        try:
+            seen = await bank.call(bank.seen_hashes, user_id, [content_hash(q) for q in variants])
+        except Exception as e:
+            print(f"讀取出題紀錄時發生錯誤: {e}")
+    return vocabulary_cache.lookup(words, skip=lambda q: content_hash(q) in seen)
+
+
+async def _review_questions(user_id: int, words: List[str]) -> Tuple[List[Dict], List[str]]:
+    # 到期或曾答錯的單字依序使用快取、本機題庫，都沒有該使用者沒看過的題目才需要生成
+    if not words:
+        return [], []
+    questions, words = await _cached_unseen(user_id, words)
+    bank = get_bank()
+    try:
+        banked = await bank.call(bank.for_targets, 'vocabulary', words, user_id=user_id)
+    except Exception as e:
+        # 題庫暫時無法讀取（例如離線建置正在寫入）時改為生成這些單字
+        print(f"讀取題庫時發生錯誤: {e}")
+        banked = {}
+    questions.extend(banked.values())
+    return questions, [w for w in words if w.strip().lower() not in banked]
+
+
+def _record_answer(user_id: int, question: Dict, correct: bool):
+    word = str(question.get('單字', '')).strip()
+    if not word:
+        return
+    try:
+        get_scheduler().record(user_id, 'vocabulary', word, correct, level=get_vocabulary().level_of(word))
+    except Exception as e:
+        print(f"寫入作答紀錄時發生錯誤: {e}")
+
+
+VOCABULARY_TEMPLATE = register_template(PromptTemplate(
+    'vocabulary',
+    prefix="""你是一個英文科測驗命題者，你的任務是為台灣的大學學測（GSAT）出題。要測試用戶是否學會最後列出的這幾個單字，請你依照學測大考中心的宗旨和難度出題並提供答案和解析，每一個單字只需要出一題，並請確保每個題目只有四個選項，而且所有題目的正確答案的選項位置是隨機分布無規律。選項必須符合台灣學測程度，所有題目的所有選項列出來看都應該獨一無二，依照該題情境所選擇。正確選項必須是唯一完全符合文意的選項，錯誤選項必須符合詞性但是放入後會造成語意錯誤或不自然或與題幹衝突或不合理或不符合語境。
+請以json格式回答並且只需要題號、單字、題目、選項、答案、詳解欄位，其他一概不需要，單字欄位填入該題要測驗的單字（必須是最後列出的其中一個），詳解請用繁體中文表達。以下為你應該遵照的json格式，詳解部分不一定要按照這個格式。
+ {
     "題號": 6,
+    "單字": "rotation",
     "題目": "The company implemented a new employee ______ program to ensure fair career development opportunities for everyone.",
-    "選項": {{
+    "選項": {
       "A": "qualification",
       "B": "rotation",
       "C": "surpass",
       "D": "analysis"
-    }},
+    },
     "答案": "B",
     "詳解": "句意為「該公司實施了新的員工______計畫，以確保每個人都有公平的職涯發展機會。」空格處應填入名詞，指公司計畫的一種形式。選項(A) qualification (資格)、(C) surpass (超越，為動詞)、(D) analysis (分析) 均不符合語意。選項(B) rotation (輪調、輪職) 符合語意，表示員工輪調計畫，讓員工有機會在不同職位上發展。"
-  }} 
+  } 
 
 以下為學測題目，讓你可以參考著出題，不要把這些例題列出輸出的json中。 
 If you put a ______ under a leaking faucet, you will be surprised at the amount of water collected in 24 hours.
@@ -145,29 +260,212 @@ Racist remarks are by nature ______ and hurtful, and should be avoided on all oc
 (A) excessive
 (B) furious
 (C) offensive
-(D) stubborn"""
+(D) stubborn""",
+    suffix="\n\n本次要測試的單字：{words}",
+))
+
+
+def generate_question_prompt(words: List[str]) -> RenderedPrompt:
+    return VOCABULARY_TEMPLATE.render(words='、'.join(words))
+
+
+vocabulary_cache = WordQuestionCache(
+    max_questions=env_int('VOCAB_CACHE_MAX_QUESTIONS', 20000),
+    variants_per_word=env_int('VOCAB_CACHE_VARIANTS', 3),
+    ttl=env_float('VOCAB_CACHE_TTL', 86400.0),
+)
+
+
+def _vocabulary_scopes(questions: List[Dict]) -> Dict[str, List[Dict]]:
+    # 題目的單字欄已對應回要求的單字（見 _normalize_targets），依級別分組存入題庫
+    by_level: Dict[str, List[Dict]] = {}
+    for q in questions:
+        if not _is_usable_question(q):
+            continue
+        vocabulary_cache.put(str(q.get('單字', '')), q)
+        level = get_vocabulary().level_of(str(q.get('單字', '')))
+        by_level.setdefault(str(level) if level else '', []).append(q)
+    return by_level
+
 
+def _store_vocabulary_questions(questions: List[Dict]):
+    bank = get_bank()
+    for scope, items in _vocabulary_scopes(questions).items():
+        bank.submit(bank.add, 'vocabulary', scope, items, target_key='單字')
 
-async def generate_questions(words: List[str]) -> List[Dict]:
+
+async def _save_vocabulary_questions(questions: List[Dict]) -> int:
+    # 離線建置需要知道實際新增的題數，等寫入完成後回傳
+    bank = get_bank()
+    added = 0
+    for scope, items in _vocabulary_scopes(questions).items():
+        added += await bank.call(bank.add, 'vocabulary', scope, items, target_key='單字')
+    return added
+
+
+async def _request_questions(
+    words: List[str], timeout: Optional[float] = None, command: str = 'vocabulary', store: bool = True
+) -> List[Dict]:
     prompt = generate_question_prompt(words)
     try:
-        response = gemini_model.generate_content(prompt)
-        content = response.text.strip()
-        if content.startswith('```json'):
-            content = content[7:-3]
-        elif content.startswith('```'):
-            content = content[3:-3]
-        questions_data = json.loads(content)
-        if isinstance(questions_data, dict):
-            return [questions_data]
-        return questions_data
-    except json.JSONDecodeError as e:
-        print(f"JSON解析錯誤: {e}")
-        print(f"原始內容: {content[:200]}...")
+        content = await get_client().generate(prompt, timeout=timeout, subject='english', command=command)
+    except asyncio.TimeoutError:
+        print("生成題目逾時")
         return []
     except Exception as e:
         print(f"生成題目時發生錯誤: {e}")
         return []
+    questions, invalid = parse_questions(content)
+    if invalid or not questions:
+        print(f"模型輸出有 {invalid} 題格式錯誤，成功解析 {len(questions)} 題；原始內容: {content[:200]}...")
+    matched = _normalize_targets(questions, words)
+    if store:
+        _store_vocabulary_questions(matched)
+    return questions
+
+
+def _is_usable_question(question: Dict) -> bool:
+    target = str(question.get('單字') or '').strip()
+    forms = get_vocabulary().forms_of(target) if target else None
+    return not question_problems(question, target=target or None, target_forms=forms)
+
+
+def _match_word(question: Dict, remaining: List[str]) -> Optional[str]:
+    word = str(question.get('單字', '')).strip().lower()
+    store = get_vocabulary()
+    # 模型標明的單字可能是變化形，例如要求 go 而標成 went
+    for w in remaining:
+        if w.lower() == word or word in store.forms_of(w):
+            return w
+    # 模型未標明或寫錯測驗單字時，改以選項內容對應
+    for w in remaining:
+        if options_contain(question, w, store.forms_of(w)):
+            return w
+    return None
+
+
+def _normalize_targets(questions: List[Dict], words: List[str]) -> List[Dict]:
+    # 模型標明的單字可能是變化形或大小寫不同，改回要求的單字，快取、題庫分級與依單字取題才對得上
+    matched = []
+    for question in questions:
+        word = _match_word(question, words) if _is_usable_question(question) else None
+        if word is None:
+            continue
+        question['單字'] = word
+        matched.append(question)
+    return matched
+
+
+async def generate_questions(
+    words: List[str], timeout: Optional[float] = None, command: str = 'vocabulary', store: bool = True
+) -> List[Dict]:
+    return await generate_with_backfill(
+        words,
+        lambda missing, time_left: _request_questions(missing, time_left, command, store),
+        _is_usable_question,
+        _match_word,
+        budget=generation_budget(timeout),
+    )
+
+
+async def stream_questions(words: List[str], timeout: Optional[float] = None) -> AsyncIterator[Dict]:
+    prompt = generate_question_prompt(words)
+    parser = JSONArrayStream()
+    collected: List[Dict] = []
+    remaining = list(words)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + generation_budget(timeout)
+
+    def accept(items: List[Dict]) -> List[Dict]:
+        accepted = []
+        for question in items:
+            word = _match_word(question, remaining) if _is_usable_question(question) else None
+            if word is None:
+                continue
+            remaining.remove(word)
+            question['單字'] = word
+            accepted.append(question)
+        collected.extend(accepted)
+        return accepted
+
+    try:
+        try:
+            async for chunk in get_client().stream(prompt, timeout=deadline - loop.time(), subject='english', command='vocabulary'):
+                for question in accept(parser.feed(chunk)):
+                    yield question
+            # 結尾仍未完成的題目會在這裡計為錯誤，並接續解析其後的題目
+            for question in accept(parser.close()):
+                yield question
+            if parser.errors:
+                print(f"串流輸出有 {parser.errors} 題格式錯誤")
+        except asyncio.TimeoutError:
+            print("串流生成題目逾時")
+        except Exception as e:
+            print(f"串流生成題目時發生錯誤: {e}")
+        if remaining and deadline - loop.time() > 0:
+            # 串流結束後只針對缺少或不合格的單字補題
+            for question in await generate_questions(remaining, timeout=deadline - loop.time()):
+                yield question
+    finally:
+        _store_vocabulary_questions(collected)
+
+
+async def _generate_pool_batch(level: int, count: int) -> Optional[List[Dict]]:
+    if not generation_limiter.try_background():
+        return None
+    try:
+        words = select_words(get_vocabulary(), count, level)
+        if not words:
+            return []
+        return await generate_questions(words, command='pool')
+    finally:
+        generation_limiter.release_unused()
+
+
+vocabulary_pool = QuestionPool(
+    range(1, 7),
+    _generate_pool_batch,
+    capacity=env_int('VOCAB_POOL_CAPACITY', 40),
+    low_water=env_int('VOCAB_POOL_LOW_WATER', 15),
+    batch_size=env_int('VOCAB_POOL_BATCH', 10),
+)
+
+
+vocabulary_prefetch = Prefetcher('english')
+
+
+async def _prefetch_vocabulary(user_id: int, count: int, level: Optional[int], seen: set) -> List[Dict]:
+    words = [w for w in select_words(get_vocabulary(), count + len(seen), level) if w.lower() not in seen][:count]
+    questions, words = await _cached_unseen(user_id, words)
+    if words:
+        questions += await generate_questions(words, timeout=PREFETCH_TIMEOUT, command='prefetch')
+    return questions
+
+
+def _prefetch_next(game_state: GameState):
+    # 接近測驗尾聲時在背景準備同級別的下一份測驗；題庫池足夠時不需要
+    if game_state.mode == 'local' or not game_state.generation_done or vocabulary_pool.depth(game_state.level) >= game_state.total_questions:
+        return
+    user_id, count, level = game_state.user_id, game_state.total_questions, game_state.level
+    seen = {str(q.get('單字', '')).strip().lower() for q in game_state.questions}
+    vocabulary_prefetch.start(user_id, level, lambda: _prefetch_vocabulary(user_id, count, level, seen))
+
+
+vocabulary_coalescer = RequestCoalescer(
+    generate_questions,
+    key=lambda q: str(q.get('單字', '')).strip().lower(),
+    window=env_float('VOCAB_COALESCE_WINDOW', 0.1),
+    max_batch=env_int('VOCAB_COALESCE_MAX_WORDS', 30),
+)
+
+
+# 冷啟動時同一時段的使用者共用一個串流，第一題完成即可開始，各自的單字陸續分回
+vocabulary_stream_coalescer = StreamCoalescer(
+    stream_questions,
+    _match_word,
+    window=env_float('VOCAB_COALESCE_WINDOW', 0.1),
+    max_batch=env_int('VOCAB_COALESCE_MAX_WORDS', 30),
+)
 
 
 def create_question_embed(question: Dict, question_num: int, total: int) -> discord.Embed:
@@ -203,88 +501,138 @@ def create_result_embed(question: Dict, user_answer: str, is_correct: bool, ques
         else:
             embed.add_field(name=f"({key})", value=value, inline=False)
     explanation_text = question['詳解'].replace('_', '\\_')
-    embed.add_field(name="詳解", value=explanation_text, inline=False)
+    add_long_field(embed, "詳解", explanation_text)
     return embed
 
 
 class QuizView(discord.ui.View):
-    def __init__(self, question: Dict, question_num: int, total: int, game_state: GameState):
+    def __init__(self, game_state: GameState):
         super().__init__(timeout=180)
-        self.question = question
-        self.question_num = question_num
-        self.total = total
         self.game_state = game_state
-        options = question['選項']
-        for key, value in options.items():
-            button = discord.ui.Button(label=f"({key}) {value}", style=discord.ButtonStyle.primary)
-            button.callback = self.create_answer_callback(key)
-            self.add_item(button)
-        stop_button = discord.ui.Button(label="停止測驗", style=discord.ButtonStyle.danger)
-        stop_button.callback = self.stop_quiz_callback
-        self.add_item(stop_button)
+        self.answered = False
+        self.show_question()
+
+    @property
+    def total(self) -> int:
+        return self.game_state.total_questions
+
+    @property
+    def question(self) -> Dict:
+        return self.game_state.questions[self.game_state.current_question]
+
+    @property
+    def question_num(self) -> int:
+        return self.game_state.current_question + 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.game_state.user_id:
+            await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+            return False
+        return True
+
+    def _add_button(self, label: str, style: discord.ButtonStyle, callback=None, name: str = ''):
+        button = discord.ui.Button(label=label, style=style, disabled=callback is None)
+        if callback is not None:
+            button.callback = button_latency.wrap(callback, view='vocabulary', button=name)
+        self.add_item(button)
+
+    def show_question(self) -> discord.Embed:
+        # 整份測驗共用同一個 View 與訊息，換題時只替換按鈕並就地編輯
+        self.answered = False
+        self.clear_items()
+        for key, value in self.question['選項'].items():
+            self._add_button(f"({key}) {value}", discord.ButtonStyle.primary, self.create_answer_callback(key), 'answer')
+        self._add_button("停止測驗", discord.ButtonStyle.danger, self.stop_quiz_callback, 'stop')
+        if self.game_state.mode != 'local':
+            # 記錄已出過的題目，之後從題庫或快取取題時略過
+            mark_seen(self.game_state.user_id, [self.question])
+        if self.total - self.question_num < PREFETCH_AHEAD:
+            _prefetch_next(self.game_state)
+        return create_question_embed(self.question, self.question_num, self.total)
+
+    def show_result(self, answer_key: str, is_correct: bool, is_last_question: bool) -> discord.Embed:
+        self.clear_items()
+        for key, value in self.question['選項'].items():
+            self._add_button(f"({key}) {value}", discord.ButtonStyle.primary)
+        if is_last_question:
+            self._add_button("測驗完成", discord.ButtonStyle.danger)
+        else:
+            self._add_button("下一題", discord.ButtonStyle.success, self.next_callback, 'next')
+        return create_result_embed(self.question, answer_key, is_correct, self.question_num, self.total)
 
     def create_answer_callback(self, answer_key: str):
         async def answer_callback(interaction: discord.Interaction):
-            if interaction.user.id != self.game_state.user_id:
-                await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+            if self.answered:
+                # 連點時只處理第一次作答
+                await interaction.response.defer()
                 return
-            correct_answer = self.question['答案']
-            is_correct = answer_key == correct_answer
+            self.answered = True
+            is_correct = answer_key == self.question['答案']
             if is_correct:
                 self.game_state.score += 1
+            _record_answer(self.game_state.user_id, self.question, is_correct)
             is_last_question = self.game_state.current_question + 1 >= self.total
-            if is_last_question and self.game_state.user_id in user_games:
-                del user_games[self.game_state.user_id]
-            result_embed = create_result_embed(self.question, answer_key, is_correct, self.question_num, self.total)
-            result_view = discord.ui.View(timeout=180)
-            for item in self.children:
-                if isinstance(item, discord.ui.Button) and item.label.startswith("("):
-                    new_item = discord.ui.Button(label=item.label, style=item.style, disabled=True)
-                    result_view.add_item(new_item)
-            if not is_last_question:
-                next_button = discord.ui.Button(label="下一題", style=discord.ButtonStyle.success)
-                async def next_callback(interaction: discord.Interaction):
-                    if interaction.user.id != self.game_state.user_id:
-                        await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
-                        return
-                    for item in self.children:
-                        item.disabled = True
-                    await interaction.response.edit_message(view=self)
-                    self.game_state.current_question += 1
-                    if self.game_state.current_question < self.total:
-                        next_question = self.game_state.questions[self.game_state.current_question]
-                        next_embed = create_question_embed(next_question, self.game_state.current_question + 1, self.total)
-                        next_view = QuizView(next_question, self.game_state.current_question + 1, self.total, self.game_state)
-                        await interaction.followup.send(embed=next_embed, view=next_view)
-                    else:
-                        if self.game_state.user_id in user_games:
-                            del user_games[self.game_state.user_id]
-                next_button.callback = next_callback
-                result_view.add_item(next_button)
+            if is_last_question:
+                user_games.release(self.game_state.user_id, self.game_state)
+                self.stop()
             else:
-                stop_button = discord.ui.Button(label="測驗完成", style=discord.ButtonStyle.danger, disabled=True)
-                result_view.add_item(stop_button)
-            await interaction.response.edit_message(embed=result_embed, view=result_view)
+                user_games.touch(self.game_state.user_id)
+            result_embed = self.show_result(answer_key, is_correct, is_last_question)
+            await interaction.response.edit_message(embed=result_embed, view=self)
         return answer_callback
 
-    async def stop_quiz_callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.game_state.user_id:
-            await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+    async def next_callback(self, interaction: discord.Interaction):
+        if not self.answered:
+            await interaction.response.defer()
             return
-        if self.game_state.user_id in user_games:
-            del user_games[self.game_state.user_id]
+        self.answered = False
+        self.game_state.current_question += 1
+        index = self.game_state.current_question
+        if index >= self.total:
+            # 背景補題失敗而縮短測驗時，原本的下一題即為結尾
+            user_games.release(self.game_state.user_id, self.game_state)
+            self.stop()
+            for item in self.children:
+                item.disabled = True
+            await interaction.response.edit_message(view=self)
+            return
+        if index < len(self.game_state.questions):
+            await interaction.response.edit_message(content="", embed=self.show_question(), view=self)
+            return
+        for item in self.children:
+            item.disabled = True
+        await interaction.response.edit_message(content="下一題生成中，請稍候...", view=self)
+        next_question = await self.game_state.wait_for_question(
+            index, timeout=min(LOCAL_FALLBACK_AFTER, interaction_timeout(interaction))
+        )
+        if next_question is None and _fill_locally(self.game_state):
+            next_question = self.game_state.questions[index] if index < len(self.game_state.questions) else None
+        if next_question is None:
+            user_games.release(self.game_state.user_id, self.game_state)
+            self.stop()
+            await interaction.edit_original_response(
+                content=f"後續題目生成失敗，測驗提前結束。得分：{self.game_state.score}/{index}", view=self
+            )
+            return
+        await interaction.edit_original_response(content="", embed=self.show_question(), view=self)
+
+    async def stop_quiz_callback(self, interaction: discord.Interaction):
+        user_games.release(self.game_state.user_id, self.game_state)
+        vocabulary_prefetch.cancel(self.game_state.user_id)
+        self.stop()
         for item in self.children:
             item.disabled = True
         stop_embed = discord.Embed(title="測驗已停止", description="測驗已被用戶停止。", color=0xe74c3c)
         await interaction.response.edit_message(embed=stop_embed, view=self)
 
     async def on_timeout(self):
-        if self.game_state.user_id in user_games:
-            del user_games[self.game_state.user_id]
+        user_games.release(self.game_state.user_id, self.game_state)
+        vocabulary_prefetch.cancel(self.game_state.user_id)
 
 
-def generate_comprehensive_prompt() -> str:
-    return (
+COMPREHENSIVE_TEMPLATE = register_template(PromptTemplate(
+    'comprehensive',
+    prefix=(
         "角色： 英文科測驗命題者，你的任務是為台灣大學學測（GSAT）設計風格多元的「綜合測驗」題組。\n"
         "任務目標： 創建一篇符合高中生程度、包含5個空格的英文短文（cloze test），並模擬學測趨勢，綜合評量考生的詞彙、文法和語篇邏輯能力。\n"
         "核心指令：主題多元化\n"
@@ -322,28 +670,62 @@ def generate_comprehensive_prompt() -> str:
         "    { \"題號\": 5, \"選項\": {\"A\": \"...\", \"B\": \"...\", \"C\": \"...\", \"D\": \"...\"}, \"答案\": \"A\", \"詳解\": \"繁體中文解析\" }\n"
         "  ]\n"
         "}\n"
-    )
+    ),
+    suffix="\n請依照上述要求產生一份新的綜合測驗題組。",
+))
 
 
-def _generate_comprehensive_data() -> Optional[Dict]:
-    prompt = generate_comprehensive_prompt()
-    response = gemini_model.generate_content(prompt)
-    content = response.text.strip()
-    if content.startswith('```json'):
-        content = content[7:-3]
-    elif content.startswith('```'):
-        content = content[3:-3]
-    data = json.loads(content)
-    if not isinstance(data, dict):
-        return None
+def generate_comprehensive_prompt() -> RenderedPrompt:
+    return COMPREHENSIVE_TEMPLATE.render()
+
+
+async def _request_comprehensive(timeout: Optional[float] = None) -> List[Dict]:
+    content = await get_client().generate(
+        generate_comprehensive_prompt(), timeout=timeout, subject='english', command='comprehensive'
+    )
+    data = parse_object(content)
     if '文本' not in data or '空格' not in data:
+        return []
+    blanks = data['空格']
+    if not isinstance(blanks, list) or len(blanks) != 5:
+        return []
+    if any(question_problems(q, require_stem=False) for q in blanks):
+        return []
+    return [data]
+
+
+async def _generate_comprehensive_data(
+    user_id: int, timeout: Optional[float] = None, admission: Optional[Callable[[], Awaitable]] = None
+) -> Optional[Dict]:
+    # 題庫裡只有這位使用者做過的題組時改為生成新的
+    bank = get_bank()
+    try:
+        banked = await bank.call(bank.sample, 'comprehensive', 1, user_id=user_id)
+    except Exception as e:
+        print(f"讀取題庫時發生錯誤: {e}")
+        banked = []
+    if banked:
+        return banked[0]
+    if admission is not None:
+        await admission()
+    generated = await generate_with_backfill(
+        ['passage'],
+        lambda _, time_left: _request_comprehensive(time_left),
+        lambda data: True,
+        lambda data, remaining: remaining[0],
+        budget=generation_budget(timeout),
+    )
+    if not generated:
         return None
-    if not isinstance(data['空格'], list) or len(data['空格']) != 5:
-        return None
+    data = generated[0]
+    bank.submit(bank.add, 'comprehensive', '', [data])
+    mark_seen(user_id, [data])
     return data
 
 
 class ComprehensiveState:
+    __slots__ = ('user_id', 'text', 'questions', 'total', 'current_index', 'user_answers', 'start_time')
+
     def __init__(self, user_id: int, data: Dict):
         self.user_id = user_id
         self.text = data['文本']
@@ -372,54 +754,61 @@ class ComprehensiveView(discord.ui.View):
     def __init__(self, state: ComprehensiveState):
         super().__init__(timeout=300)
         self.state = state
-        options = self.state.questions[self.state.current_index]['選項']
-        for key, value in options.items():
+        self.show_question()
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.state.user_id:
+            await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+            return False
+        return True
+
+    def show_question(self) -> discord.Embed:
+        # 整份題組共用同一則訊息，每答一題就地換成下一題的選項
+        self.clear_items()
+        index = self.state.current_index
+        q = self.state.questions[index]
+        for key, value in q['選項'].items():
             button = discord.ui.Button(label=f"({key}) {value}", style=discord.ButtonStyle.primary)
-            button.callback = self.create_answer_callback(key)
+            button.callback = button_latency.wrap(self.create_answer_callback(key, index), view='comprehensive', button='answer')
             self.add_item(button)
         stop_button = discord.ui.Button(label="停止測驗", style=discord.ButtonStyle.danger)
-        stop_button.callback = self.stop_quiz_callback
+        stop_button.callback = button_latency.wrap(self.stop_quiz_callback, view='comprehensive', button='stop')
         self.add_item(stop_button)
+        return create_comprehensive_question_embed(q, index + 1, self.state.total, self.state.text)
 
-    def create_answer_callback(self, answer_key: str):
+    def create_answer_callback(self, answer_key: str, index: int):
         async def answer_callback(interaction: discord.Interaction):
-            if interaction.user.id != self.state.user_id:
-                await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+            if self.state.current_index != index:
+                # 連點時只處理第一次作答
+                await interaction.response.defer()
                 return
             self.state.user_answers.append(answer_key)
             self.state.current_index += 1
-            is_last_done = self.state.current_index >= self.state.total
+            if self.state.current_index < self.state.total:
+                user_games.touch(self.state.user_id)
+                await interaction.response.edit_message(embed=self.show_question(), view=self)
+                return
+            user_games.release(self.state.user_id, self.state)
+            self.stop()
             for item in self.children:
                 item.disabled = True
             await interaction.response.edit_message(view=self)
-            if is_last_done:
-                if self.state.user_id in user_games:
-                    del user_games[self.state.user_id]
-                await self.show_summary(interaction)
-            else:
-                next_q = self.state.questions[self.state.current_index]
-                embed = create_comprehensive_question_embed(next_q, self.state.current_index + 1, self.state.total, self.state.text)
-                next_view = ComprehensiveView(self.state)
-                await interaction.followup.send(embed=embed, view=next_view)
+            await self.show_summary(interaction)
         return answer_callback
 
     async def stop_quiz_callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.state.user_id:
-            await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
-            return
-        if self.state.user_id in user_games:
-            del user_games[self.state.user_id]
+        user_games.release(self.state.user_id, self.state)
+        self.stop()
         for item in self.children:
             item.disabled = True
         stop_embed = discord.Embed(title="測驗已停止", description="綜合測驗已被用戶停止。", color=0xe74c3c)
         await interaction.response.edit_message(embed=stop_embed, view=self)
 
     async def on_timeout(self):
-        if self.state.user_id in user_games:
-            del user_games[self.state.user_id]
+        user_games.release(self.state.user_id, self.state)
 
     async def show_summary(self, interaction: discord.Interaction):
-        detail_embed = discord.Embed(title="題目解答與詳解", color=0x3498db)
+        paginator = EmbedPaginator("題目解答與詳解", 0x3498db)
         for idx, q in enumerate(self.state.questions):
             options = q.get('選項', {})
             correct_key = q.get('答案')
@@ -438,16 +827,33 @@ class ComprehensiveView(discord.ui.View):
                 f"正確答案: {correct_key} {correct_value}\n\n"
                 f"詳解: {expl_text}"
             )
-            opt_chunks = _chunk_text(option_block, 1024)
-            expl_chunks = _chunk_text(explanation_full, 1024)
             head = f"第 {idx+1} 題"
-            for j, c in enumerate(opt_chunks):
-                n = head if j == 0 else f"{head}（續）"
-                detail_embed.add_field(name=n, value=c, inline=False)
-            for j, c in enumerate(expl_chunks):
-                n = f"{head} 詳解" if j == 0 else f"{head} 詳解（續）"
-                detail_embed.add_field(name=n, value=c, inline=False)
-        await interaction.followup.send(embed=detail_embed)
+            paginator.add_field(head, option_block)
+            paginator.add_field(f"{head} 詳解", explanation_full)
+        # 長篇詳解會自動分頁，避免超過 Discord 單一 embed 的欄位與字數上限
+        await send_embeds(interaction.followup.send, paginator.embeds)
+
+
+async def _send_first_question(
+    interaction: discord.Interaction, game_state: GameState, started: float, source: str, notice: str = ''
+):
+    if not game_state.questions:
+        user_games.release(interaction.user.id, game_state)
+        await send_rejection(interaction, "生成題目時發生錯誤，請稍後再試。")
+        return
+    first_question = game_state.questions[0]
+    embed = create_question_embed(first_question, 1, game_state.total_questions)
+    view = QuizView(game_state)
+    if not interaction.response.is_done():
+        await interaction.response.send_message(content=notice or None, embed=embed, view=view)
+        first_question_latency.observe(time.perf_counter() - started, command='vocabulary', source=source)
+        return
+    try:
+        await interaction.edit_original_response(content=notice, embed=embed, view=view)
+        first_question_latency.observe(time.perf_counter() - started, command='vocabulary', source=source)
+    except discord.errors.NotFound:
+        user_games.release(interaction.user.id, game_state)
+        await interaction.followup.send("互動已超時，請重新開始測驗。", ephemeral=True)
 
 
 class English(app_commands.Group):
@@ -455,7 +861,14 @@ class English(app_commands.Group):
         super().__init__(name="english", description="英文科")
 
     @app_commands.command(name="vocabulary", description="開始詞彙測驗")
-    async def start_quiz(self, interaction: discord.Interaction, questions: int = 5, level: Optional[int] = None):
+    @app_commands.describe(mode="出題方式：AI 生成情境題，或由單字表直接出中英對照題（不需等待）")
+    @app_commands.choices(mode=[
+        app_commands.Choice(name="AI 生成", value="ai"),
+        app_commands.Choice(name="單字表快速出題", value="local"),
+    ])
+    async def start_quiz(
+        self, interaction: discord.Interaction, questions: int = 5, level: Optional[int] = None, mode: Optional[str] = None
+    ):
         if questions < 1 or questions > 20:
             await interaction.response.send_message("題數必須在1-20之間！", ephemeral=True)
             return
@@ -465,54 +878,160 @@ class English(app_commands.Group):
         if interaction.user.id in user_games:
             await interaction.response.send_message("你已經有一個進行中的測驗！請先完成或等待超時。", ephemeral=True)
             return
-        game_state = GameState(interaction.user.id, questions, level)
-        user_games[interaction.user.id] = game_state
-        selected_words = select_words(vocabulary_df, questions, level)
-        game_state.selected_words = selected_words
-        if not interaction.response.is_done():
-            await interaction.response.send_message("正在生成詞彙測驗，請稍候...")
-        questions_data = await generate_questions(selected_words)
-        if not questions_data:
-            await interaction.followup.send("生成題目時發生錯誤，請稍後再試。", ephemeral=True)
-            del user_games[interaction.user.id]
+        started = time.perf_counter()
+        game_state = GameState(interaction.user.id, questions, level, mode or 'ai')
+        try:
+            await user_games.claim(interaction.user.id, game_state, shard_for(interaction))
+        except SessionRejected as e:
+            await send_rejection(interaction, str(e))
             return
+        user_id = interaction.user.id
+        review_words = await _review_words(user_id, questions, level)
+        if game_state.mode == 'local':
+            # 直接由單字表出題，到期複習的單字優先，不呼叫 Gemini
+            local = _local_questions.get()
+            game_state.questions = local.build(review_words)
+            game_state.questions += local.sample(questions - len(game_state.questions), level, exclude=review_words)
+            game_state.finish_generation()
+            await _send_first_question(interaction, game_state, started, 'local')
+            return
+        vocabulary_pool.start()
+        questions_data, generate_words = await _review_questions(user_id, review_words)
+        # 同一份測驗每個單字只出一次：各來源的題目都先與已選入的單字比對
+        seen = {w.strip().lower() for w in review_words}
+        source = 'review' if review_words else 'pool'
+        missing = questions - len(questions_data) - len(generate_words)
+        if missing:
+            # 上一份測驗結尾時預先生成的題目，直接交給這一份使用；等待時間與單字表備援共用上限
+            prefetched = await vocabulary_prefetch.take(
+                interaction.user.id, level, min(LOCAL_FALLBACK_AFTER, interaction_timeout(interaction)),
+                on_wait=lambda: send_status(interaction, "正在生成詞彙測驗，請稍候..."),
+            )
+            prefetched = _unique(prefetched, seen)[:missing]
+            if prefetched:
+                questions_data += prefetched
+                source = 'prefetch'
+            missing = questions - len(questions_data) - len(generate_words)
+        if missing:
+            questions_data += _unique(vocabulary_pool.take(missing, level), seen)
+            missing = questions - len(questions_data) - len(generate_words)
+        if missing:
+            bank = get_bank()
+            try:
+                banked = await bank.call(
+                    bank.sample, 'vocabulary', missing,
+                    scope=str(level) if level else None, exclude_targets=list(seen), user_id=user_id,
+                )
+            except Exception as e:
+                print(f"讀取題庫時發生錯誤: {e}")
+                banked = []
+            questions_data += _unique(banked, seen)
+            missing = questions - len(questions_data) - len(generate_words)
+            source = 'bank'
         game_state.questions = questions_data
-        first_question = questions_data[0]
-        embed = create_question_embed(first_question, 1, questions)
-        view = QuizView(first_question, 1, questions, game_state)
-        try:
-            await interaction.edit_original_response(content="", embed=embed, view=view)
-        except discord.errors.NotFound:
-            if interaction.user.id in user_games:
-                del user_games[interaction.user.id]
-            await interaction.followup.send("互動已超時，請重新開始測驗。", ephemeral=True)
+        if missing:
+            new_words: List[str] = []
+            for word in select_words(get_vocabulary(), missing + len(seen), level):
+                key = word.strip().lower()
+                if key not in seen and len(new_words) < missing:
+                    seen.add(key)
+                    new_words.append(word)
+            # 常見單字多半已有其他使用者生成過的題目，只針對沒有快取的單字生成
+            cached, new_words = await _cached_unseen(user_id, new_words)
+            game_state.questions.extend(cached)
+            generate_words += new_words
+            source = 'cache' if cached else source
+        if generate_words:
+            source = 'partial' if game_state.questions else 'stream'
+            game_state.selected_words = generate_words
+            game_state.expect_more()
+            if game_state.questions:
+                # 已有題目可先開始作答，不足的題目在背景合併生成後再補上
+                _spawn(_append_later(game_state, _admitted_submit(interaction, generate_words)))
+            else:
+                try:
+                    # 排隊太久也視同額度用盡，改由單字表出題
+                    await admit(interaction, timeout=LOCAL_FALLBACK_AFTER)
+                except RateLimited:
+                    # 額度用盡時改由單字表出題，不讓使用者空手而回
+                    _fill_locally(game_state)
+                    game_state.finish_generation()
+                    await _send_first_question(
+                        interaction, game_state, started, 'local', "目前生成請求較多，本次改由單字表出題。"
+                    )
+                    return
+                await send_status(interaction, "正在生成詞彙測驗，請稍候...")
+                # 串流生成：第一題完成即可開始測驗，其餘題目陸續加入
+                task = _spawn(_append_stream(
+                    game_state,
+                    vocabulary_stream_coalescer.stream(generate_words, timeout=interaction_timeout(interaction)),
+                ))
+                first = await game_state.wait_for_question(
+                    0, timeout=min(LOCAL_FALLBACK_AFTER, interaction_timeout(interaction))
+                )
+                if first is None:
+                    # 生成太慢或失敗時取消串流，改由單字表出題
+                    task.cancel()
+                    if _fill_locally(game_state):
+                        source = 'local'
+        await _send_first_question(interaction, game_state, started, source)
 
     @app_commands.command(name="comprehensive", description="開始綜合測驗")
     async def comprehensive_command(self, interaction: discord.Interaction):
         if interaction.user.id in user_games:
             await interaction.response.send_message("你已經有一個進行中的測驗！請先完成或等待超時。", ephemeral=True)
             return
+        started = time.perf_counter()
         if not interaction.response.is_done():
             await interaction.response.send_message("正在生成綜合測驗，請稍候...")
+
+        generated = False
+
+        async def admission():
+            nonlocal generated
+            generated = True
+            await admit(interaction)
+            await send_status(interaction, "正在生成綜合測驗，請稍候...")
+
         try:
-            data = _generate_comprehensive_data()
+            data = await _generate_comprehensive_data(
+                interaction.user.id, timeout=interaction_timeout(interaction), admission=admission
+            )
             if not data:
-                await interaction.edit_original_response(content="生成題目時發生錯誤，請稍後再試。")
+                await send_status(interaction, "生成題目時發生錯誤，請稍後再試。")
                 return
             state = ComprehensiveState(interaction.user.id, data)
-            user_games[interaction.user.id] = state
+            try:
+                await user_games.claim(interaction.user.id, state, shard_for(interaction))
+            except SessionRejected as e:
+                await interaction.edit_original_response(content=str(e))
+                return
             first_q = state.questions[0]
             embed = create_comprehensive_question_embed(first_q, 1, state.total, state.text)
             view = ComprehensiveView(state)
             await interaction.edit_original_response(content="", embed=embed, view=view)
-        except json.JSONDecodeError as e:
-            await interaction.edit_original_response(content=f"生成內容非合法JSON，請重試。錯誤：{e}")
+            first_question_latency.observe(time.perf_counter() - started, command='comprehensive', source='generated' if generated else 'bank')
+        except RateLimited as e:
+            await send_rejection(interaction, str(e))
+        except asyncio.TimeoutError:
+            await send_status(interaction, "生成綜合測驗逾時，請稍後再試。")
         except Exception as e:
-            await interaction.edit_original_response(content=f"生成綜合測驗時發生錯誤：{e}")
+            await send_status(interaction, f"生成綜合測驗時發生錯誤：{e}")
+
+
 
+async def warm_up():
+    await _vocabulary.load_async()
+    get_client()
+    get_bank()
+    await _local_questions.load_async()
+    get_scheduler()
+    vocabulary_pool.start()
+    user_games.start_sweeper()
 
 
 def register(bot: commands.Bot):
     bot.tree.add_command(English())
+    register_warmup('english', warm_up)
 
 
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+
+import discord
+import google.generativeai as genai
+from dotenv import load_dotenv
+from google.ai import generativelanguage as glm
+from google.generativeai.types import AsyncGenerateContentResponse
+
+from metrics import gemini_errors, gemini_latency
+from model_router import Backend, ModelRouter, router_from_env
+from prompts import RenderedPrompt
+from settings import env_float, env_int
+from token_usage import token_usage
+
+
+MODEL_NAME = 'gemini-2.5-flash-lite'
+INTERACTION_LIFETIME = timedelta(minutes=15)
+
+PromptType = Union[str, RenderedPrompt]
+
+
+class GeminiClient:
+    def __init__(
+        self,
+        router: ModelRouter,
+        max_concurrency: int = 4,
+        timeout: float = 60.0,
+        context_cache: bool = False,
+        cache_ttl: float = 3600.0,
+        limiter=None,
+    ):
+        self.router = router
+        # 每個送往後端的請求都向限流器取得令牌，包含重複請求與改用其他後端
+        self.limiter = limiter
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.context_cache = context_cache
+        self.cache_ttl = cache_ttl
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._cached_models: Dict[Tuple[str, str], Tuple[genai.GenerativeModel, float]] = {}
+        self._cache_pending: Set[Tuple[str, str]] = set()
+        self._cache_failed: Set[Tuple[str, str]] = set()
+        self._cache_tasks: Set[asyncio.Task] = set()
+        self.in_flight = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 延後到事件迴圈啟動後才建立，避免綁定到 import 時的迴圈
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _create_cached_model(self, backend: Backend, prompt: RenderedPrompt) -> genai.GenerativeModel:
+        from google.generativeai import caching
+        cached = caching.CachedContent.create(
+            model=backend.model.model_name,
+            display_name=f"gsat-{prompt.template.name}",
+            contents=[prompt.prefix],
+            ttl=timedelta(seconds=self.cache_ttl),
+        )
+        return genai.GenerativeModel.from_cached_content(cached)
+
+    async def _build_cache(self, backend: Backend, prompt: RenderedPrompt):
+        key = (backend.name, prompt.template.name)
+        try:
+            loop = asyncio.get_running_loop()
+            model = await loop.run_in_executor(None, self._create_cached_model, backend, prompt)
+            # 提前一分鐘視為過期，避免用到剛失效的快取
+            self._cached_models[key] = (model, time.monotonic() + self.cache_ttl - 60)
+        except Exception as e:
+            # 前綴太短或模型不支援時不再重試，改用完整提示
+            self._cache_failed.add(key)
+            print(f"建立提示快取失敗（{key[1]}，{key[0]}）: {e}")
+        finally:
+            self._cache_pending.discard(key)
+
+    def _select_model(self, backend: Backend, prompt: PromptType) -> Tuple[genai.GenerativeModel, str]:
+        if not isinstance(prompt, RenderedPrompt):
+            return backend.model, prompt
+        # context cache 建立在預設金鑰底下，其他金鑰的後端一律送完整提示
+        if not self.context_cache or not prompt.dynamic or not backend.default_key:
+            return backend.model, prompt.text
+        key = (backend.name, prompt.template.name)
+        cached = self._cached_models.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0], prompt.dynamic
+        if key not in self._cache_pending and key not in self._cache_failed:
+            self._cache_pending.add(key)
+            # 保留任務的參照，避免建立到一半被回收
+            task = asyncio.ensure_future(self._build_cache(backend, prompt))
+            self._cache_tasks.add(task)
+            task.add_done_callback(self._cache_tasks.discard)
+        return backend.model, prompt.text
+
+    async def _charge(self):
+        if self.limiter is not None:
+            await self.limiter.charge()
+
+    def _charged(self, attempt):
+        # 第一次呼叫在進入路由前就已取得令牌，等待時間不計入後端延遲；重複請求與改用其他後端時再各扣一個
+        calls = 0
+
+        async def run(backend: Backend):
+            nonlocal calls
+            calls += 1
+            if calls > 1:
+                await self._charge()
+            return await attempt(backend)
+        return run
+
+    async def _call_model(self, backend: Backend, prompt: PromptType, stream: bool) -> AsyncGenerateContentResponse:
+        model, contents = self._select_model(backend, prompt)
+        if backend.client is None or model is not backend.model:
+            return await model.generate_content_async(contents, stream=stream)
+        # 以各金鑰自己的公開用戶端呼叫，不依賴 SDK 的全域金鑰設定
+        request = glm.GenerateContentRequest(
+            model=model.model_name,
+            contents=[glm.Content(role='user', parts=[glm.Part(text=contents)])],
+        )
+        if stream:
+            return await AsyncGenerateContentResponse.from_aiterator(await backend.client.stream_generate_content(request))
+        return AsyncGenerateContentResponse.from_response(await backend.client.generate_content(request))
+
+    async def _attempt(self, backend: Backend, prompt: PromptType):
+        response = await self._call_model(backend, prompt, stream=False)
+        # 被擋下或沒有內容的回應在這裡就拋出錯誤，交由路由改用其他後端
+        if not response.text:
+            raise ValueError("模型回傳空白內容")
+        return response
+
+    async def _generate(self, prompt: PromptType, subject: str, command: str) -> str:
+        await self._charge()
+        async with self._get_semaphore():
+            self.in_flight += 1
+            try:
+                with gemini_latency.time(subject=subject, command=command, mode='generate'):
+                    response = await self.router.race(
+                        'generate', self._charged(lambda backend: self._attempt(backend, prompt))
+                    )
+            finally:
+                self.in_flight -= 1
+        token_usage.record_response(subject, command, response)
+        return response.text
+
+    async def generate(self, prompt: PromptType, timeout: Optional[float] = None, subject: str = '', command: str = '') -> str:
+        limit = self.timeout if timeout is None else min(timeout, self.timeout)
+        if limit <= 0:
+            raise asyncio.TimeoutError()
+        # 等待名額與呼叫模型都計入逾時；逾時會取消底層請求
+        try:
+            return await asyncio.wait_for(self._generate(prompt, subject, command), timeout=limit)
+        except asyncio.TimeoutError:
+            gemini_errors.inc(subject=subject, command=command, kind='timeout')
+            raise
+        except Exception:
+            gemini_errors.inc(subject=subject, command=command, kind='error')
+            raise
+
+    async def _open_stream(self, backend: Backend, prompt: PromptType):
+        response = await self._call_model(backend, prompt, stream=True)
+        chunks = response.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return chunks, first
+
+    async def stream(self, prompt: PromptType, timeout: Optional[float] = None, subject: str = '', command: str = '') -> AsyncIterator[str]:
+        limit = self.timeout if timeout is None else min(timeout, self.timeout)
+        if limit <= 0:
+            raise asyncio.TimeoutError()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + limit
+        await asyncio.wait_for(self._charge(), timeout=limit)
+        semaphore = self._get_semaphore()
+        await asyncio.wait_for(semaphore.acquire(), timeout=max(deadline - loop.time(), 0.001))
+        self.in_flight += 1
+        last_chunk = None
+        started = loop.time()
+        try:
+            # 第一個片段之前可以改用其他後端或送出重複請求，開始輸出後就固定使用同一個串流
+            chunks, chunk = await asyncio.wait_for(
+                self.router.race('stream', self._charged(lambda backend: self._open_stream(backend, prompt))),
+                timeout=max(deadline - loop.time(), 0.001),
+            )
+            while chunk is not None:
+                last_chunk = chunk
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # 結尾的片段可能只有結束原因而沒有文字
+                    text = ''
+                if text:
+                    yield text
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    chunk = None
+        except asyncio.TimeoutError:
+            gemini_errors.inc(subject=subject, command=command, kind='timeout')
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception:
+            gemini_errors.inc(subject=subject, command=command, kind='error')
+            raise
+        finally:
+            gemini_latency.observe(loop.time() - started, subject=subject, command=command, mode='stream')
+            self.in_flight -= 1
+            semaphore.release()
+            if last_chunk is not None:
+                # 串流的用量統計附在最後一個片段
+                token_usage.record_response(subject, command, last_chunk)
+
+
+def interaction_timeout(interaction: discord.Interaction) -> float:
+    created_at = interaction.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    remaining = created_at + INTERACTION_LIFETIME - datetime.now(timezone.utc)
+    return remaining.total_seconds()
+
+
+_client: Optional[GeminiClient] = None
+
+
+def _backends_from_env() -> List[Backend]:
+    keys = [k.strip() for k in os.getenv('GEMINI_API_KEYS', '').split(',') if k.strip()]
+    if not keys and os.getenv('GEMINI_API_KEY'):
+        keys = [os.getenv('GEMINI_API_KEY')]
+    if not keys:
+        raise ValueError("請設定GEMINI_API_KEY環境變數")
+    models = [m.strip() for m in os.getenv('GEMINI_MODELS', MODEL_NAME).split(',') if m.strip()] or [MODEL_NAME]
+    # 全域金鑰只供 context cache 使用，一般請求都走各金鑰自己的用戶端
+    genai.configure(api_key=keys[0])
+    clients = [glm.GenerativeServiceAsyncClient(client_options={'api_key': key}) for key in keys]
+    backends: List[Backend] = []
+    # 依模型優先順序，每個模型再依序使用各組金鑰
+    for model_name in models:
+        for index, client in enumerate(clients):
+            backends.append(Backend(
+                f"{model_name}#{index + 1}", genai.GenerativeModel(model_name), default_key=index == 0, client=client,
+            ))
+    return backends
+
+
+def get_client() -> GeminiClient:
+    global _client
+    if _client is None:
+        from rate_limiter import generation_limiter
+
+        load_dotenv()
+        _client = GeminiClient(
+            router_from_env(_backends_from_env()),
+            max_concurrency=env_int('GEMINI_MAX_CONCURRENCY', 4),
+            timeout=env_float('GEMINI_TIMEOUT', 60.0),
+            context_cache=os.getenv('GEMINI_CONTEXT_CACHE', '').lower() in ('1', 'true', 'yes'),
+            cache_ttl=env_float('GEMINI_CONTEXT_CACHE_TTL', 3600.0),
+            limiter=generation_limiter,
+        )
+    return _client
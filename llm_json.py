@@ -0,0 +1,200 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import parse_latency
+
+
+# 可能是下一個獨立元素開頭的大括號：前面緊接逗號、陣列開頭或上一個物件的結尾
+_ITEM_START = re.compile(r'[,\[}]\s*(\{)')
+_SPACE = re.compile(r'\s*')
+
+
+class JSONArrayStream:
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._item_depth: Optional[int] = None
+        self._start: Optional[int] = None
+        self._object_start: Optional[int] = None
+        self._broken = False
+        self._in_string = False
+        self._escape = False
+        self._decoder = json.JSONDecoder()
+        self.errors = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        self._text += chunk
+        items: List[Any] = []
+        self._scan(items, final=False)
+        # 只保留尚未完成的元素，讓總解析成本與輸出長度成線性
+        keep = self._start if self._start is not None else self._object_start if self._item_depth is None else None
+        if keep is None:
+            self._text = ''
+            self._pos = 0
+        else:
+            self._text = self._text[keep:]
+            self._pos -= keep
+            if self._start is not None:
+                self._start -= keep
+            if self._object_start is not None:
+                self._object_start -= keep
+        return items
+
+    def close(self) -> List[Any]:
+        # 輸出結束時仍未完成的元素視為格式錯誤，並從其後可獨立解析的物件接續
+        items: List[Any] = []
+        if self._item_depth is None and self._object_start is not None:
+            self._enter_objects()
+        self._scan(items, final=True)
+        self._text = ''
+        self._pos = 0
+        self._start = None
+        return items
+
+    def _scan(self, items: List[Any], final: bool):
+        while True:
+            if not self._broken:
+                self._advance(items)
+            if self._start is None or not (self._broken or final):
+                return
+            if self._resync(items, final):
+                continue
+            if final:
+                self.errors += 1
+                self._start = None
+                self._broken = False
+            return
+
+    def _advance(self, items: List[Any]):
+        text = self._text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._item_depth is None:
+                # 略過代碼框或前言，遇到陣列才開始解析；前言裡的大括號只有在後面沒有陣列時才當成物件
+                if ch == '{' and self._object_start is None:
+                    self._object_start = i
+                elif ch == '[':
+                    mode = self._preamble_mode(i)
+                    if mode is None:
+                        break
+                    if mode == 'object':
+                        self._enter_objects()
+                        i = self._pos
+                        continue
+                    self._item_depth = 1
+                    self._depth = 1
+                    self._object_start = None
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{' or ch == '[':
+                if ch == '{' and self._depth == self._item_depth:
+                    self._start = i
+                self._depth += 1
+            elif ch == '}' or ch == ']':
+                self._depth -= 1
+                if ch == '}' and self._depth == self._item_depth and self._start is not None:
+                    try:
+                        items.append(json.loads(text[self._start:i + 1]))
+                    except json.JSONDecodeError:
+                        # 字串中未跳脫的引號等錯誤會讓後續狀態都不可信，改由 _resync 找下一個元素
+                        self._broken = True
+                        self._pos = i + 1
+                        return
+                    self._start = None
+            i += 1
+        self._pos = i
+
+    def _preamble_mode(self, bracket: int) -> Optional[str]:
+        if self._object_start is None:
+            return 'array'
+        try:
+            _, end = self._decoder.raw_decode(self._text, self._object_start)
+        except json.JSONDecodeError as e:
+            # 物件還沒傳完時等待更多內容；說明文字裡的大括號則以後面的陣列為準
+            if e.msg.startswith('Unterminated string') or e.pos >= len(self._text.rstrip()):
+                return None
+            return 'array'
+        return 'object' if end > bracket else 'array'
+
+    def _enter_objects(self):
+        self._item_depth = 0
+        self._depth = 0
+        self._pos = self._object_start
+        self._object_start = None
+        self._start = None
+        self._in_string = False
+        self._escape = False
+
+    def _resync(self, items: List[Any], final: bool) -> bool:
+        text = self._text
+        for match in _ITEM_START.finditer(text, self._start + 1):
+            begin = match.start(1)
+            try:
+                item, end = self._decoder.raw_decode(text, begin)
+            except json.JSONDecodeError:
+                continue
+            after = _SPACE.match(text, end).end()
+            follow = text[after:after + 1]
+            if not isinstance(item, dict) or (follow and follow not in ',]{') or (not follow and not final):
+                continue
+            self.errors += 1
+            items.append(item)
+            self._start = None
+            self._broken = False
+            self._in_string = False
+            self._escape = False
+            self._depth = self._item_depth
+            self._pos = end
+            return True
+        return False
+
+
+OPTION_KEYS = ('A', 'B', 'C', 'D')
+
+
+def is_valid_question(question: Any, explanation_key: str = '詳解', require_stem: bool = True) -> bool:
+    if not isinstance(question, dict):
+        return False
+    if require_stem and not (isinstance(question.get('題目'), str) and question['題目'].strip()):
+        return False
+    options = question.get('選項')
+    if not isinstance(options, dict) or sorted(options.keys()) != list(OPTION_KEYS):
+        return False
+    if not all(isinstance(v, str) and v.strip() for v in options.values()):
+        return False
+    answer = question.get('答案')
+    if not isinstance(answer, str) or answer.strip() not in OPTION_KEYS:
+        return False
+    question['答案'] = answer.strip()
+    return isinstance(question.get(explanation_key), str)
+
+
+def parse_questions(text: str, explanation_key: str = '詳解', require_stem: bool = True) -> Tuple[List[Dict], int]:
+    # 逐一解析每個題目物件，單一題目格式錯誤不影響其他題目
+    with parse_latency.time(kind='questions'):
+        stream = JSONArrayStream()
+        items = stream.feed(text or '') + stream.close()
+        valid = [q for q in items if is_valid_question(q, explanation_key, require_stem)]
+    return valid, len(items) - len(valid) + stream.errors
+
+
+def parse_object(text: str) -> Dict:
+    content = text or ''
+    start = content.find('{')
+    if start < 0:
+        raise json.JSONDecodeError("找不到 JSON 物件", content, 0)
+    with parse_latency.time(kind='object'):
+        data, _ = json.JSONDecoder().raw_decode(content[start:])
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError("JSON 內容不是物件", content, start)
+    return data
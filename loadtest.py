@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="離線壓力測試：以模擬的 Discord 互動與假模型驅動各科測驗")
+    parser.add_argument('--users', type=int, default=50, help="同時進行測驗的模擬使用者數")
+    parser.add_argument('--rounds', type=int, default=1, help="每位使用者依序完成的測驗次數")
+    parser.add_argument('--scenario', choices=['vocabulary', 'comprehensive', 'social', 'mixed'], default='mixed')
+    parser.add_argument('--vocab-mode', choices=['ai', 'local'], default='ai', help="詞彙測驗的出題方式")
+    parser.add_argument('--questions', type=int, default=5, help="詞彙與社會科每次測驗的題數")
+    parser.add_argument('--guilds', type=int, default=5, help="模擬使用者分散的伺服器數")
+    parser.add_argument('--ramp', type=float, default=0.0, help="在幾秒內陸續啟動所有使用者")
+    parser.add_argument('--think-time', type=float, default=0.0, help="每次按下按鈕前的等待秒數")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="模擬 Discord API 回應延遲（秒）")
+    parser.add_argument('--llm-latency', type=float, default=1.0, help="假模型回應的平均延遲（秒）")
+    parser.add_argument('--llm-jitter', type=float, default=0.3, help="假模型延遲的標準差（秒）")
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0, help="假模型請求失敗的機率")
+    parser.add_argument('--llm-slow-rate', type=float, default=0.0, help="假模型偶發極慢回應的機率")
+    parser.add_argument('--llm-slow-factor', type=float, default=10.0, help="極慢回應是平均延遲的幾倍")
+    parser.add_argument('--backends', type=int, default=1, help="模擬的模型後端（金鑰／模型）數")
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.05, help="串流時每個片段之間的延遲（秒）")
+    parser.add_argument('--pool', action='store_true', help="啟用詞彙題庫池的背景補充")
+    parser.add_argument('--rate-limit', action='store_true', help="保留 RATE_* 環境變數設定的限流，而非放寬")
+    parser.add_argument('--bank-path', default=None, help="題庫檔案位置（預設使用暫存檔）")
+    parser.add_argument('--tracemalloc', action='store_true', help="以 tracemalloc 量測 Python 記憶體峰值（會拖慢執行）")
+    return parser.parse_args()
+
+
+class _Usage:
+    __slots__ = ('prompt_token_count', 'candidates_token_count', 'cached_content_token_count')
+
+    def __init__(self, prompt: str, output: str):
+        self.prompt_token_count = len(prompt) // 2
+        self.candidates_token_count = len(output) // 2
+        self.cached_content_token_count = 0
+
+
+class _StubResponse:
+    def __init__(self, text: str, usage: Optional[_Usage] = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class _StubStream:
+    def __init__(self, chunks: List[str], delay: float, usage: _Usage):
+        self._chunks = chunks
+        self._delay = delay
+        self._usage = usage
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self._chunks):
+            await asyncio.sleep(self._delay)
+            yield _StubResponse(chunk, self._usage if i == len(self._chunks) - 1 else None)
+
+
+class StubModel:
+    model_name = 'models/stub'
+
+    def __init__(
+        self, latency: float, jitter: float, failure_rate: float, chunk_delay: float,
+        slow_rate: float = 0.0, slow_factor: float = 10.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.chunk_delay = chunk_delay
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.calls = 0
+        self.failures = 0
+
+    async def generate_content_async(self, contents, stream: bool = False):
+        self.calls += 1
+        prompt = contents if isinstance(contents, str) else str(contents)
+        delay = max(0.0, random.gauss(self.latency, self.jitter))
+        if random.random() < self.slow_rate:
+            delay *= self.slow_factor
+        await asyncio.sleep(delay)
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            raise RuntimeError("模擬的模型錯誤")
+        text = self._answer(prompt)
+        usage = _Usage(prompt, text)
+        if not stream:
+            return _StubResponse(text, usage)
+        size = max(1, len(text) // 8)
+        return _StubStream([text[i:i + size] for i in range(0, len(text), size)], self.chunk_delay, usage)
+
+    def _answer(self, prompt: str) -> str:
+        words = re.search(r"本次要測試的單字：(.+)\s*$", prompt)
+        if words:
+            return json.dumps([self._vocabulary(w.strip()) for w in words.group(1).split('、') if w.strip()], ensure_ascii=False)
+        count = re.search(r"產生(\d+)題社會科單選題", prompt)
+        if count:
+            return json.dumps([self._choice(i, '解析') for i in range(int(count.group(1)))], ensure_ascii=False)
+        blanks = []
+        for i in range(5):
+            blank = self._choice(i, '詳解')
+            blank.pop('題目')
+            blank['題號'] = i + 1
+            blanks.append(blank)
+        return json.dumps({'文本': ' '.join(f"word __{i + 1}__" for i in range(5)), '空格': blanks}, ensure_ascii=False)
+
+    def _vocabulary(self, word: str) -> Dict:
+        question = self._choice(0, '詳解', answer_text=word)
+        question['單字'] = word
+        question['題目'] = f"The {'_' * 6} is a test for {word}."
+        return question
+
+    def _choice(self, index: int, explanation_key: str, answer_text: Optional[str] = None) -> Dict:
+        keys = ['A', 'B', 'C', 'D']
+        answer = random.choice(keys)
+        nonce = random.getrandbits(32)
+        options = {k: f"option-{nonce}-{index}-{k}" for k in keys}
+        if answer_text is not None:
+            options[answer] = answer_text
+        return {'題目': f"模擬題目 {nonce}-{index}", '選項': options, '答案': answer, explanation_key: "模擬詳解"}
+
+
+class _FakeClient:
+    def __init__(self, shard_count: int = 1):
+        self.shard_count = shard_count
+
+
+class _FakeUser:
+    def __init__(self, user_id: int, guild_id: int, api_latency: float):
+        self.id = user_id
+        self.guild_id = guild_id
+        self.api_latency = api_latency
+        self.latest_view = None
+        self.messages = 0
+
+    async def deliver(self, view):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        self.messages += 1
+        if view is not None:
+            self.latest_view = view
+
+
+class _FakeResponse:
+    def __init__(self, user: _FakeUser):
+        self._user = user
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        self._done = True
+        await self._user.deliver(view)
+
+    async def edit_message(self, content=None, *, embed=None, view=None, **kwargs):
+        self._done = True
+        await self._user.deliver(view)
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+
+class _FakeFollowup:
+    def __init__(self, user: _FakeUser):
+        self._user = user
+
+    async def send(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        await self._user.deliver(view)
+
+
+class FakeInteraction:
+    def __init__(self, user: _FakeUser, client: _FakeClient):
+        self.user = user
+        self.guild_id = user.guild_id
+        self.client = client
+        self.command = None
+        self.created_at = datetime.now(timezone.utc)
+        self.response = _FakeResponse(user)
+        self.followup = _FakeFollowup(user)
+
+    async def edit_original_response(self, content=None, *, embed=None, view=None, **kwargs):
+        await self.user.deliver(view)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.completed = 0
+        self.failed = 0
+        self.clicks = 0
+        self.api_calls = 0
+
+    def add(self, name: str, value: float):
+        self.latencies.setdefault(name, []).append(value)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _next_button(view):
+    if view is None:
+        return None
+    buttons = [item for item in view.children if getattr(item, 'label', None) and not item.disabled]
+    for button in buttons:
+        if button.label == "下一題":
+            return button
+    answers = [b for b in buttons if b.label.startswith("(")]
+    return random.choice(answers) if answers else None
+
+
+async def _run_quiz(scenario: str, user: _FakeUser, client: _FakeClient, groups: Dict, args, recorder: Recorder):
+    interaction = FakeInteraction(user, client)
+    user.latest_view = None
+    start = time.perf_counter()
+    if scenario == 'vocabulary':
+        await groups['english'].start_quiz.callback(groups['english'], interaction, args.questions, None, args.vocab_mode)
+    elif scenario == 'comprehensive':
+        await groups['english'].comprehensive_command.callback(groups['english'], interaction)
+    else:
+        await groups['social'].choice.callback(groups['social'], interaction, args.questions, None)
+    recorder.add(f"{scenario}:command", time.perf_counter() - start)
+    if user.latest_view is None:
+        recorder.failed += 1
+        return
+    clicked = set()
+    for _ in range(200):
+        view = user.latest_view
+        button = _next_button(view)
+        if button is None or button in clicked:
+            break
+        clicked.add(button)
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+        click_start = time.perf_counter()
+        await button.callback(FakeInteraction(user, client))
+        recorder.add(f"{scenario}:button", time.perf_counter() - click_start)
+        recorder.clicks += 1
+    recorder.completed += 1
+
+
+async def _run_user(index: int, args, client: _FakeClient, groups: Dict, recorder: Recorder):
+    if args.ramp:
+        await asyncio.sleep(args.ramp * index / max(1, args.users))
+    user = _FakeUser(10_000 + index, (index % max(1, args.guilds) + 1) << 22, args.api_latency)
+    scenarios = ['vocabulary', 'comprehensive', 'social']
+    for round_index in range(args.rounds):
+        scenario = args.scenario if args.scenario != 'mixed' else scenarios[(index + round_index) % len(scenarios)]
+        try:
+            await _run_quiz(scenario, user, client, groups, args, recorder)
+        except Exception as e:
+            recorder.failed += 1
+            print(f"使用者 {user.id} 執行 {scenario} 時發生錯誤: {e!r}")
+    recorder.api_calls += user.messages
+
+
+async def _watch_loop_lag(samples: List[float], interval: float = 0.01):
+    # 量測事件迴圈被阻塞的時間，數值偏高代表有同步的重工作
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def _main(args):
+    import english
+    import gemini_client
+    import social
+    from model_router import Backend, router_from_env
+    from rate_limiter import generation_limiter
+    from token_usage import token_usage
+
+    model = StubModel(
+        args.llm_latency, args.llm_jitter, args.llm_failure_rate, args.llm_chunk_delay, args.llm_slow_rate, args.llm_slow_factor
+    )
+    # 多個後端共用同一個假模型，統計數字一併計算
+    router = router_from_env([Backend(f"stub#{i + 1}", model) for i in range(max(1, args.backends))])
+    gemini_client._client = gemini_client.GeminiClient(
+        router,
+        max_concurrency=gemini_client.env_int('GEMINI_MAX_CONCURRENCY', 4),
+        timeout=gemini_client.env_float('GEMINI_TIMEOUT', 60.0),
+        limiter=generation_limiter,
+    )
+    if not args.pool:
+        english.vocabulary_pool.low_water = 0
+    groups = {'english': english.English(), 'social': social.Social()}
+    client = _FakeClient()
+    recorder = Recorder()
+    lag: List[float] = []
+    watcher = asyncio.ensure_future(_watch_loop_lag(lag))
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(_run_user(i, args, client, groups, recorder) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    english.vocabulary_pool.stop()
+
+    print(f"\n使用者：{args.users}　每人測驗次數：{args.rounds}　情境：{args.scenario}")
+    print(f"總耗時：{elapsed:.2f} 秒　完成測驗：{recorder.completed}　失敗：{recorder.failed}")
+    print(f"吞吐量：{recorder.completed / elapsed:.2f} 測驗/秒　{(recorder.completed + recorder.clicks) / elapsed:.2f} 互動/秒")
+    print(f"模型呼叫：{model.calls}（失敗 {model.failures}）　重複請求 {router.hedges}（勝出 {router.hedge_wins}）　改用其他後端 {router.failovers}")
+    print(f"Discord 訊息傳送／編輯：{recorder.api_calls}（每次互動 {recorder.api_calls / max(1, recorder.completed + recorder.clicks):.2f} 次）")
+    print(f"{'項目':<24}{'次數':>8}{'p50(ms)':>12}{'p99(ms)':>12}{'max(ms)':>12}")
+    for name, values in sorted(recorder.latencies.items()):
+        print(f"{name:<24}{len(values):>8}{_percentile(values, 50) * 1000:>12.1f}{_percentile(values, 99) * 1000:>12.1f}{max(values) * 1000:>12.1f}")
+    if lag:
+        print(f"事件迴圈延遲：平均 {statistics.mean(lag) * 1000:.2f} ms　p99 {_percentile(lag, 99) * 1000:.2f} ms　最大 {max(lag) * 1000:.2f} ms")
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 回報，macOS 以 byte 回報
+    rss_mb = max_rss / 1024 / 1024 if sys.platform == 'darwin' else max_rss / 1024
+    print(f"最大常駐記憶體：{rss_mb:.1f} MB")
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Python 配置記憶體：目前 {current / 1024 / 1024:.1f} MB　峰值 {peak / 1024 / 1024:.1f} MB")
+    cache_stats = english.vocabulary_cache.stats()
+    print(f"單字題目快取：{cache_stats['words']} 個單字　命中率 {cache_stats['hit_rate']:.0%}")
+    for name, prefetcher in (('英文', english.vocabulary_prefetch), ('社會', social.social_prefetch)):
+        stats = prefetcher.stats()
+        print(f"預先生成（{name}）：啟動 {stats['started']}　接手 {stats['hits']}　略過 {stats['skipped']}　未使用 {stats['wasted']}")
+    print(f"進行中測驗殘留：英文 {len(english.user_games)}　社會 {len(social.social_games)}")
+    for (subject, command), usage in token_usage.top(5):
+        print(f"token 用量 {subject}/{command}：輸入 {usage['input']}　輸出 {usage['output']}")
+
+
+def main():
+    args = _parse_args()
+    workdir = tempfile.mkdtemp(prefix='gsat-loadtest-')
+    # 必須在載入各科模組前設定，模組載入時會讀取這些環境變數
+    os.environ['QUESTION_BANK_PATH'] = args.bank_path or os.path.join(workdir, 'question_bank.sqlite3')
+    os.environ['REVIEW_DB_PATH'] = os.path.join(workdir, 'reviews.sqlite3')
+    os.environ['SESSION_BACKEND'] = 'memory'
+    if not args.rate_limit:
+        for name in ('RATE_GLOBAL_PER_MINUTE', 'RATE_GUILD_PER_MINUTE', 'RATE_USER_PER_MINUTE'):
+            os.environ[name] = '1000000'
+        for name in ('RATE_GLOBAL_BURST', 'RATE_GUILD_BURST', 'RATE_USER_BURST', 'RATE_QUEUE_MAX'):
+            os.environ[name] = '1000000'
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from vocabulary import VocabularyStore
+
+
+OPTION_KEYS = ('A', 'B', 'C', 'D')
+
+
+class _Pair:
+    __slots__ = ('word', 'meaning', 'level')
+
+    def __init__(self, word: str, meaning: str, level: int):
+        self.word = word
+        self.meaning = meaning
+        self.level = level
+
+
+class LocalQuestionBuilder:
+    def __init__(self, store: VocabularyStore):
+        # 預先依級別攤平成 (單字, 中文) 配對，出題時只需隨機抽取，不必掃描整份單字表
+        self._by_word: Dict[str, _Pair] = {}
+        pairs: List[_Pair] = []
+        for entry in store.entries:
+            for i, variant in enumerate(entry.variants):
+                meaning = entry.meanings[i] if i < len(entry.meanings) and entry.meanings[i] else (entry.meanings[0] if entry.meanings else '')
+                if not meaning:
+                    continue
+                pair = _Pair(variant, meaning, entry.level)
+                pairs.append(pair)
+                self._by_word.setdefault(variant.lower(), pair)
+        grouped: Dict[int, List[_Pair]] = {}
+        for pair in pairs:
+            grouped.setdefault(pair.level, []).append(pair)
+        self.by_level: Dict[int, Tuple[_Pair, ...]] = {level: tuple(items) for level, items in grouped.items()}
+        self.pairs: Tuple[_Pair, ...] = tuple(pairs)
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def _distractors(self, answer: _Pair, count: int) -> List[_Pair]:
+        population = self.by_level.get(answer.level) or self.pairs
+        if len(population) <= count:
+            population = self.pairs
+        picked: List[_Pair] = []
+        seen_words = {answer.word.lower()}
+        seen_meanings = {answer.meaning}
+        # 同級別的干擾選項難度相近；中文或拼法相同的配對會讓題目有兩個正解，需排除
+        for _ in range(count * 10):
+            if len(picked) >= count:
+                break
+            candidate = random.choice(population)
+            if candidate.word.lower() in seen_words or candidate.meaning in seen_meanings:
+                continue
+            seen_words.add(candidate.word.lower())
+            seen_meanings.add(candidate.meaning)
+            picked.append(candidate)
+        return picked
+
+    def question(self, word: str) -> Optional[Dict]:
+        answer = self._by_word.get(word.strip().lower())
+        if answer is None:
+            return None
+        distractors = self._distractors(answer, len(OPTION_KEYS) - 1)
+        if len(distractors) < len(OPTION_KEYS) - 1:
+            return None
+        choices = distractors + [answer]
+        random.shuffle(choices)
+        reverse = random.random() < 0.5
+        if reverse:
+            stem = f"「{answer.meaning}」的英文是下列哪一個？"
+            options = {key: pair.word for key, pair in zip(OPTION_KEYS, choices)}
+        else:
+            stem = f"「{answer.word}」的中文意思是下列哪一個？"
+            options = {key: pair.meaning for key, pair in zip(OPTION_KEYS, choices)}
+        correct = OPTION_KEYS[choices.index(answer)]
+        others = '\n'.join(
+            f"({key}) {pair.word}：{pair.meaning}" for key, pair in zip(OPTION_KEYS, choices) if pair is not answer
+        )
+        return {
+            '題目': stem,
+            '選項': options,
+            '答案': correct,
+            '詳解': f"{answer.word}：{answer.meaning}（第 {answer.level} 級）\n其他選項：\n{others}",
+            '單字': answer.word,
+        }
+
+    def build(self, words: Iterable[str]) -> List[Dict]:
+        questions = []
+        for word in words:
+            question = self.question(word)
+            if question is not None:
+                questions.append(question)
+        return questions
+
+    def sample(self, count: int, level: Optional[int] = None, exclude: Iterable[str] = ()) -> List[Dict]:
+        population = self.by_level.get(level, ()) if level else self.pairs
+        excluded = {w.strip().lower() for w in exclude}
+        candidates = [p for p in random.sample(population, min(len(population), count + len(excluded)))
+                      if p.word.lower() not in excluded]
+        return self.build(p.word for p in candidates[:count])
@@ -1,6 +1,13 @@
 import os
+import sys
+import json
+import asyncio
+import hashlib
+import math
 import socket
 import platform
+import time
+import traceback
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -13,30 +20,153 @@ import chinese
 import subject_math
 import science
 import social
+import metrics
+import resources
+from embed_pages import add_long_field
+from gemini_client import get_client
+from rate_limiter import generation_limiter
+from shard_metrics import shard_for, shard_metrics
+from token_usage import token_usage
+
+
+def _cli_option(name: str):
+    if name in sys.argv:
+        idx = sys.argv.index(name)
+        if idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+    return None
+
+
+def shard_config() -> dict:
+    config = {}
+    shard_count = _cli_option('--shard-count') or os.getenv('SHARD_COUNT')
+    shard_ids = _cli_option('--shard-ids') or os.getenv('SHARD_IDS')
+    try:
+        if shard_count:
+            config['shard_count'] = int(shard_count)
+        if shard_ids:
+            # 指定本行程負責的分片，例如 0,1 或 0-3
+            ids = []
+            for part in shard_ids.split(','):
+                part = part.strip()
+                if '-' in part:
+                    start, end = part.split('-', 1)
+                    ids.extend(range(int(start), int(end) + 1))
+                elif part:
+                    ids.append(int(part))
+            config['shard_ids'] = ids
+    except ValueError:
+        raise SystemExit(f"分片設定格式錯誤：SHARD_COUNT={shard_count!r}，SHARD_IDS={shard_ids!r}")
+    if 'shard_ids' in config:
+        # 只指定分片編號時無法得知總分片數，自動分片又會讓多個行程連上同一個分片，因此直接停止
+        if 'shard_count' not in config:
+            raise SystemExit("已設定 SHARD_IDS（--shard-ids），但缺少 SHARD_COUNT（--shard-count）：請一併指定總分片數")
+        invalid = [i for i in config['shard_ids'] if not 0 <= i < config['shard_count']]
+        if invalid:
+            raise SystemExit(f"SHARD_IDS 中的分片 {invalid} 超出 SHARD_COUNT={config['shard_count']} 的範圍（0-{config['shard_count'] - 1}）")
+    return config
 
 
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix='', intents=intents)
+bot = commands.AutoShardedBot(command_prefix='', intents=intents, **shard_config())
+_warm_up_task = None
+_commands_synced = False
+COMMAND_HASH_PATH = os.getenv('COMMAND_HASH_PATH', '.command_tree_hash')
+FORCE_SYNC = '--force-sync' in sys.argv or os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'yes')
+
+
+def _command_payload(cmd) -> dict:
+    try:
+        return cmd.to_dict(bot.tree)
+    except TypeError:
+        # discord.py 2.4 之前的 to_dict 不接受 tree 參數
+        return cmd.to_dict()
+
+
+def command_tree_hash() -> str:
+    payload = sorted((_command_payload(cmd) for cmd in bot.tree.get_commands()), key=lambda c: c.get('name', ''))
+    raw = json.dumps({'application_id': bot.application_id, 'commands': payload}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _read_saved_hash() -> str:
+    try:
+        with open(COMMAND_HASH_PATH, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _save_hash(value: str):
+    try:
+        with open(COMMAND_HASH_PATH, 'w', encoding='utf-8') as f:
+            f.write(value)
+    except OSError as e:
+        print(f"儲存指令雜湊時發生錯誤: {e}")
+
+
+async def sync_commands(force: bool = False):
+    top_level_cmds = bot.tree.get_commands()
+    invokable_total = 0
+    for cmd in top_level_cmds:
+        if isinstance(cmd, app_commands.Group):
+            invokable_total += len(cmd.commands)
+        else:
+            invokable_total += 1
+    current = command_tree_hash()
+    if not force and _read_saved_hash() == current:
+        print(f"斜線指令未變更，略過同步；可用指令總數（含子指令）= {invokable_total}")
+        return
+    synced = await bot.tree.sync()
+    _save_hash(current)
+    print(f"已同步 {len(synced)} 個頂層指令/群組；可用指令總數（含子指令）= {invokable_total}")
+
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    shard_metrics.record_interaction(shard_for(interaction))
+
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    # 從 Discord 建立互動起算，包含網路延遲與等待生成的時間
+    metrics.command_latency.observe(time.time() - interaction.created_at.timestamp(), command=command.qualified_name)
+
+
+@bot.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    command = interaction.command.qualified_name if interaction.command else 'unknown'
+    metrics.command_errors.inc(command=command)
+    print(f"執行指令 {command} 時發生錯誤:", file=sys.stderr)
+    traceback.print_exception(type(error), error, error.__traceback__)
+    message = "執行指令時發生錯誤，請稍後再試。"
+    try:
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+    except discord.HTTPException:
+        pass
 
 
 @bot.event
 async def on_ready():
+    global _warm_up_task, _commands_synced
     print(f'{bot.user} 已上線！')
+    if _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(resources.warm_up_all())
+    # on_ready 在重新連線後也會觸發，每個行程只需檢查一次
+    if _commands_synced:
+        return
     try:
-        synced = await bot.tree.sync()
-        top_level_cmds = bot.tree.get_commands()
-        invokable_total = 0
-        for cmd in top_level_cmds:
-            if isinstance(cmd, app_commands.Group):
-                invokable_total += len(cmd.commands)
-            else:
-                invokable_total += 1
-        print(f"已同步 {len(synced)} 個頂層指令/群組；可用指令總數（含子指令）= {invokable_total}")
+        await sync_commands(force=FORCE_SYNC)
+        _commands_synced = True
     except Exception as e:
         print(f"同步斜線指令時發生錯誤: {e}")
 
 
 def register_subjects():
+    resources.register_warmup('metrics', metrics.start_server)
     english.register(bot)
     #chinese.register(bot)
     #subject_math.register(bot)
@@ -56,7 +186,7 @@ if __name__ == "__main__":
         )
         embed.add_field(
             name="指令",
-            value="""`/english vocabulary [questions] [level]` - 英文詞彙測驗
+            value="""`/english vocabulary [questions] [level] [mode]` - 英文詞彙測驗（mode 可選單字表快速出題）
 `/english comprehensive` - 英文綜合測驗
 `/social choice [questions] [subject]` - 社會科單選題""",
             inline=False
@@ -65,6 +195,7 @@ if __name__ == "__main__":
             name="參數說明",
             value="""questions：題數（英文 1-20；社會 1-10；預設 5）
 level：英文等級 1-6（可不選，未指定則從所有級別挑選）
+mode：英文詞彙出題方式（AI 生成／單字表快速出題）
 subject：社會科別（歷史/地理/公民）""",
             inline=False
         )
@@ -78,6 +209,16 @@ subject：社會科別（歷史/地理/公民）""",
     @bot.tree.command(name="about", description="關於這個機器人")
     async def about_command(interaction: discord.Interaction):
         latency_ms = int(round(bot.latency * 1000)) if bot.latency is not None else -1
+        sessions = {}
+        for store in (english.user_games, social.social_games):
+            for shard_id, count in store.counts_by_shard().items():
+                sessions[shard_id] = sessions.get(shard_id, 0) + count
+        shard_lines = []
+        for shard_id, shard_latency in bot.latencies:
+            shard_ms = int(round(shard_latency * 1000)) if not math.isnan(shard_latency) else -1
+            shard_lines.append(
+                f"#{shard_id}：延遲 {shard_ms} ms • 互動 {shard_metrics.interaction_rate(shard_id):.0f}/分 • 測驗 {sessions.get(shard_id, 0)} 個"
+            )
         host_info = f"{platform.system()} {platform.release()} • {socket.gethostname()}"
         embed = discord.Embed(
             title="關於 GSAT 學測練習機器人",
@@ -91,7 +232,7 @@ subject：社會科別（歷史/地理/公民）""",
         )
         embed.add_field(
             name="怎麼做到的",
-            value="""透過 Google Gemini 2.5 Flash Lite 技術支援以產生題目、選項與詳解""",
+            value=f"透過 Google Gemini（{'、'.join(get_client().router.model_names())}）產生題目、選項與詳解",
             inline=False
         )
         embed.add_field(
@@ -100,11 +241,54 @@ subject：社會科別（歷史/地理/公民）""",
 - [政客迷因](https://discord.com/oauth2/authorize?client_id=1400469248869924964)""",
             inline=False
         )
+        pool_stats = english.vocabulary_pool.stats()
+        embed.add_field(
+            name="詞彙題庫池",
+            value=f"存量：{sum(pool_stats['depth'].values())} 題\n命中率：{pool_stats['hit_rate']:.0%}",
+            inline=False
+        )
+        cache_stats = english.vocabulary_cache.stats()
+        embed.add_field(
+            name="單字題目快取",
+            value=f"單字：{cache_stats['words']}　題目：{cache_stats['questions']}\n命中率：{cache_stats['hit_rate']:.0%}",
+            inline=False
+        )
+        limiter_stats = generation_limiter.stats()
+        embed.add_field(
+            name="生成請求",
+            value=f"排隊中：{limiter_stats['queue']}\n已放行：{limiter_stats['admitted']}\n已拒絕：{limiter_stats['rejected']}\n額外扣除（重試、重複請求）：{limiter_stats['charged']}\n合併退回：{limiter_stats['released']}",
+            inline=False
+        )
+        backend_lines = [
+            f"{b['name']}：{'可用' if b['available'] else '冷卻中'} • p50 {b['p50'] or 0:.1f}s • p95 {b['p95'] or 0:.1f}s • 錯誤率 {b['error_rate']:.0%}"
+            for b in get_client().router.stats()
+        ]
+        # 後端多或模型名稱長時分到續欄，不超過 Discord 單一欄位的字數上限
+        add_long_field(embed, "模型後端", "\n".join(backend_lines))
+        prefetch_lines = [
+            f"{name}：接手 {stats['hits']}／啟動 {stats['started']}"
+            for name, stats in (('英文', english.vocabulary_prefetch.stats()), ('社會', social.social_prefetch.stats()))
+        ]
+        embed.add_field(name="預先生成", value="\n".join(prefetch_lines), inline=False)
+        usage_lines = [
+            f"{subject or '—'}/{command or '—'}：輸入 {u['input']}（快取 {u['cached']}）、輸出 {u['output']}"
+            for (subject, command), u in token_usage.top(5)
+        ]
+        embed.add_field(
+            name="Token 用量（前 5 名）",
+            value="\n".join(usage_lines) or "—",
+            inline=False
+        )
         embed.add_field(
             name="系統與延遲",
             value=f"主機：{host_info}\n位置：Helsinki, Finland\n延遲：{latency_ms} ms",
             inline=False
         )
+        embed.add_field(
+            name=f"分片狀態（共 {bot.shard_count or 1} 個）",
+            value="\n".join(shard_lines[:20]) or "—",
+            inline=False
+        )
         await interaction.response.send_message(embed=embed)
     bot.run(os.getenv('DISCORD_TOKEN'))
 
@@ -0,0 +1,194 @@
+import bisect
+import functools
+import math
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from settings import env_int
+
+
+LabelKey = Tuple[str, ...]
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+_registry: List['_Metric'] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + ''.join(line + '\n' for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._functions: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        # 於抓取時才讀取目前數值，例如進行中的測驗數
+        self._functions[self._key(labels)] = fn
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        for key, fn in self._functions.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def time(self, **labels) -> '_Timer':
+        return _Timer(self, labels)
+
+    def wrap(self, fn: Callable[..., Awaitable], **labels) -> Callable[..., Awaitable]:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start, **labels)
+        return wrapper
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def render_all() -> str:
+    return ''.join(metric.render() for metric in _registry)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_all(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_server(host: Optional[str] = None, port: Optional[int] = None):
+    global _runner
+    port = env_int('METRICS_PORT', 0) if port is None else port
+    if _runner is not None or port <= 0:
+        return
+    host = host or os.getenv('METRICS_HOST', '127.0.0.1')
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _runner = runner
+    print(f"監控指標已開放於 http://{host}:{port}/metrics")
+
+
+command_latency = Histogram('gsat_command_seconds', '斜線指令從建立到處理完成的時間', ('command',))
+command_errors = Counter('gsat_command_errors_total', '斜線指令發生錯誤的次數', ('command',))
+gemini_latency = Histogram('gsat_gemini_request_seconds', 'Gemini 請求時間', ('subject', 'command', 'mode'))
+gemini_errors = Counter('gsat_gemini_errors_total', 'Gemini 請求失敗次數', ('subject', 'command', 'kind'))
+parse_latency = Histogram('gsat_parse_seconds', '模型輸出解析時間', ('kind',), buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+first_question_latency = Histogram('gsat_first_question_seconds', '從收到指令到顯示第一題的時間', ('command', 'source'))
+button_latency = Histogram('gsat_button_callback_seconds', '按鈕回呼處理時間', ('view', 'button'))
+session_timeouts = Counter('gsat_session_timeouts_total', '測驗因閒置逾時被清除的次數', ('subject',))
+active_sessions = Gauge('gsat_active_sessions', '進行中的測驗數', ('subject',))
+prefetch_events = Counter('gsat_prefetch_total', '預先生成下一份測驗的次數與結果', ('subject', 'outcome'))
+gemini_backend_latency = Histogram('gsat_gemini_backend_seconds', '各模型後端成功回應的時間（串流為第一個片段）', ('backend', 'mode'))
+gemini_hedges = Counter('gsat_gemini_hedges_total', '延遲過久而送出的重複請求次數與勝出次數', ('outcome',))
+gemini_failovers = Counter('gsat_gemini_failovers_total', '模型後端失敗而改用其他後端的次數', ('backend', 'reason'))
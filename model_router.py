@@ -0,0 +1,199 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from metrics import gemini_backend_latency, gemini_failovers, gemini_hedges
+from settings import env_float
+
+
+QUOTA_MARKERS = ('429', 'quota', 'resource exhausted', 'resource_exhausted', 'rate limit')
+
+
+def is_quota_error(error: BaseException) -> bool:
+    try:
+        from google.api_core import exceptions
+        if isinstance(error, (exceptions.ResourceExhausted, exceptions.TooManyRequests)):
+            return True
+    except ImportError:
+        pass
+    text = str(error).lower()
+    return any(marker in text for marker in QUOTA_MARKERS)
+
+
+class Backend:
+    __slots__ = ('name', 'model', 'client', 'default_key', 'samples', 'requests', 'errors', 'error_rate', 'cooldown_until', 'in_flight')
+
+    def __init__(self, name: str, model: Any, default_key: bool = True, window: int = 200, client: Any = None):
+        self.name = name
+        self.model = model
+        # 各組金鑰自己的非同步用戶端；未設定時直接呼叫 model
+        self.client = client
+        # 只有使用預設金鑰的後端可以共用 context cache
+        self.default_key = default_key
+        self.samples: Dict[str, Deque[float]] = {
+            'generate': deque(maxlen=window),
+            'stream': deque(maxlen=window),
+        }
+        self.requests = 0
+        self.errors = 0
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+
+    @property
+    def available(self) -> bool:
+        return self.cooldown_until <= time.monotonic()
+
+    def percentile(self, kind: str, pct: float) -> Optional[float]:
+        values = sorted(self.samples[kind])
+        if not values:
+            return None
+        index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+        return values[index]
+
+    def record(self, kind: str, seconds: Optional[float], error: bool):
+        self.requests += 1
+        # 錯誤率以指數移動平均計算，近期的失敗影響較大
+        self.error_rate = self.error_rate * 0.9 + (0.1 if error else 0.0)
+        if error:
+            self.errors += 1
+        elif seconds is not None:
+            self.samples[kind].append(seconds)
+            gemini_backend_latency.observe(seconds, backend=self.name, mode=kind)
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        backends: Sequence[Backend],
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 1.0,
+        hedge_default_delay: float = 10.0,
+        hedge_ratio: float = 0.1,
+        min_samples: int = 20,
+        quota_cooldown: float = 60.0,
+    ):
+        if not backends:
+            raise ValueError("至少需要一個模型後端")
+        self.backends: List[Backend] = list(backends)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_ratio = hedge_ratio
+        self.min_samples = min_samples
+        self.quota_cooldown = quota_cooldown
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def pick(self, exclude: Sequence[Backend] = (), allow_repeat: bool = False) -> Optional[Backend]:
+        # 依設定順序優先使用主要後端；冷卻中或近期錯誤率高的後端排到後面
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates and allow_repeat:
+            candidates = [b for b in self.backends if b.available]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (not b.available, b.error_rate >= 0.5, self.backends.index(b)))
+
+    def hedge_delay(self, backend: Backend, kind: str) -> Optional[float]:
+        if self.hedge_ratio <= 0 or self.hedges >= self.hedge_ratio * self.calls + 1:
+            return None
+        if len(backend.samples[kind]) < self.min_samples:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, backend.percentile(kind, self.hedge_percentile))
+
+    def record_failure(self, backend: Backend, kind: str, error: BaseException):
+        backend.record(kind, None, error=True)
+        if is_quota_error(error):
+            backend.cooldown_until = time.monotonic() + self.quota_cooldown
+            gemini_failovers.inc(backend=backend.name, reason='quota')
+        else:
+            gemini_failovers.inc(backend=backend.name, reason='error')
+
+    async def race(self, kind: str, attempt: Callable[[Backend], Awaitable[Any]]) -> Any:
+        # 先送出一個請求；超過該後端延遲百分位仍未回應時再送一個重複請求，取先成功的結果；
+        # 失敗時改用下一個後端，直到所有後端都試過
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        tried: List[Backend] = []
+        pending: Dict[asyncio.Task, Tuple[Backend, float]] = {}
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch(allow_repeat: bool = False) -> bool:
+            backend = self.pick(tried, allow_repeat=allow_repeat)
+            if backend is None:
+                return False
+            tried.append(backend)
+            backend.in_flight += 1
+            pending[asyncio.ensure_future(attempt(backend))] = (backend, loop.time())
+            return True
+
+        launch()
+        first = next(iter(pending))
+        try:
+            while pending:
+                delay = None if hedged else self.hedge_delay(tried[0], kind)
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if launch(allow_repeat=True):
+                        self.hedges += 1
+                        gemini_hedges.inc(outcome='fired')
+                    continue
+                for task in done:
+                    backend, started = pending.pop(task)
+                    backend.in_flight -= 1
+                    error = task.exception()
+                    if error is None:
+                        backend.record(kind, loop.time() - started, error=False)
+                        if hedged and task is not first:
+                            self.hedge_wins += 1
+                            gemini_hedges.inc(outcome='won')
+                        return task.result()
+                    last_error = error
+                    self.record_failure(backend, kind, error)
+                if not pending:
+                    if not launch():
+                        break
+                    self.failovers += 1
+        finally:
+            for task, (backend, _) in pending.items():
+                backend.in_flight -= 1
+                task.cancel()
+        raise last_error
+
+    def model_names(self) -> List[str]:
+        # 依優先順序列出設定的模型，多組金鑰共用同一個模型時只列一次
+        names: List[str] = []
+        for backend in self.backends:
+            name = str(getattr(backend.model, 'model_name', backend.name)).split('/')[-1]
+            if name not in names:
+                names.append(name)
+        return names
+
+    def stats(self) -> List[Dict]:
+        return [
+            {
+                'name': b.name,
+                'available': b.available,
+                'requests': b.requests,
+                'error_rate': b.error_rate,
+                'p50': b.percentile('generate', 50),
+                'p95': b.percentile('generate', 95),
+            }
+            for b in self.backends
+        ]
+
+
+def router_from_env(backends: Sequence[Backend]) -> ModelRouter:
+    return ModelRouter(
+        backends,
+        hedge_percentile=env_float('GEMINI_HEDGE_PERCENTILE', 95.0),
+        hedge_min_delay=env_float('GEMINI_HEDGE_MIN_DELAY', 1.0),
+        hedge_default_delay=env_float('GEMINI_HEDGE_DEFAULT_DELAY', 10.0),
+        hedge_ratio=env_float('GEMINI_HEDGE_RATIO', 0.1),
+        quota_cooldown=env_float('GEMINI_QUOTA_COOLDOWN', 60.0),
+    )
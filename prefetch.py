@@ -0,0 +1,152 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from metrics import prefetch_events
+from rate_limiter import generation_limiter
+from settings import env_float, env_int
+
+
+PREFETCH_AHEAD = env_int('PREFETCH_AHEAD', 2)
+PREFETCH_WINDOW = env_float('PREFETCH_WINDOW', 300.0)
+PREFETCH_TIMEOUT = env_float('PREFETCH_TIMEOUT', 60.0)
+PREFETCH_TAKE_TIMEOUT = env_float('PREFETCH_TAKE_TIMEOUT', 8.0)
+PREFETCH_MAX_INFLIGHT = env_int('PREFETCH_MAX_INFLIGHT', 4)
+PREFETCH_RESERVE = env_float('PREFETCH_GLOBAL_RESERVE', 2.0)
+
+
+class _Prefetch:
+    __slots__ = ('key', 'task', 'timer')
+
+    def __init__(self, key: Hashable, task: asyncio.Task, timer: asyncio.TimerHandle):
+        self.key = key
+        self.task = task
+        self.timer = timer
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        subject: str,
+        window: float = PREFETCH_WINDOW,
+        max_inflight: int = PREFETCH_MAX_INFLIGHT,
+        reserve: float = PREFETCH_RESERVE,
+        on_unused: Optional[Callable[[Hashable, List[Dict]], None]] = None,
+    ):
+        self.subject = subject
+        self.window = window
+        self.max_inflight = max(0, max_inflight)
+        self.reserve = reserve
+        self._on_unused = on_unused
+        self._entries: Dict[int, _Prefetch] = {}
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _inflight(self) -> int:
+        return sum(1 for e in self._entries.values() if not e.task.done())
+
+    def _count(self, outcome: str):
+        prefetch_events.inc(subject=self.subject, outcome=outcome)
+
+    def start(self, user_id: int, key: Hashable, generate: Callable[[], Awaitable[List[Dict]]]) -> bool:
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.key == key:
+            return False
+        if self._inflight() >= self.max_inflight or not generation_limiter.try_speculative(user_id, self.reserve):
+            self.skipped += 1
+            self._count('skipped')
+            return False
+        self.cancel(user_id)
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(self._run(generate))
+        # 時間窗內沒有開始下一份測驗就丟棄，避免替不會再來的使用者佔著記憶體
+        timer = loop.call_later(self.window, self._expire, user_id, task)
+        self._entries[user_id] = _Prefetch(key, task, timer)
+        self.started += 1
+        self._count('started')
+        return True
+
+    async def _run(self, generate: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        try:
+            return await asyncio.wait_for(generate(), timeout=PREFETCH_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"預先生成{self.subject}題目逾時")
+        except Exception as e:
+            print(f"預先生成{self.subject}題目時發生錯誤: {e}")
+        finally:
+            # 由快取或題庫湊齊題目而沒有呼叫模型時，退回放行時取得的令牌
+            generation_limiter.release_unused()
+        return []
+
+    def _expire(self, user_id: int, task: asyncio.Task):
+        entry = self._entries.get(user_id)
+        if entry is None or entry.task is not task:
+            return
+        del self._entries[user_id]
+        self._discard(entry)
+
+    def _discard(self, entry: _Prefetch):
+        entry.timer.cancel()
+        if not entry.task.done():
+            entry.task.cancel()
+            self._count('cancelled')
+            return
+        self.wasted += 1
+        self._count('wasted')
+        questions = entry.task.result() if not entry.task.cancelled() else []
+        if questions and self._on_unused is not None:
+            self._on_unused(entry.key, questions)
+
+    def cancel(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._discard(entry)
+
+    async def take(
+        self,
+        user_id: int,
+        key: Hashable,
+        timeout: float,
+        on_wait: Optional[Callable[[], Awaitable]] = None,
+    ) -> List[Dict]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry.key != key:
+            self.misses += 1
+            return []
+        del self._entries[user_id]
+        entry.timer.cancel()
+        if not entry.task.done():
+            # 已經在生成中時接手等待，比重新生成一份更快
+            if on_wait is not None:
+                await on_wait()
+            try:
+                await asyncio.wait_for(asyncio.shield(entry.task), timeout=timeout)
+            except asyncio.TimeoutError:
+                entry.task.cancel()
+                self.misses += 1
+                self._count('cancelled')
+                return []
+        questions = entry.task.result() if not entry.task.cancelled() else []
+        if questions:
+            self.hits += 1
+            self._count('hit')
+        else:
+            self.misses += 1
+        return questions
+
+    def stats(self) -> Dict:
+        return {
+            'pending': len(self._entries),
+            'started': self.started,
+            'skipped': self.skipped,
+            'hits': self.hits,
+            'wasted': self.wasted,
+            'hit_rate': self.hits / self.started if self.started else 0.0,
+        }
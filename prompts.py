@@ -0,0 +1,43 @@
+from typing import Dict
+
+
+class RenderedPrompt:
+    __slots__ = ('template', 'dynamic')
+
+    def __init__(self, template: 'PromptTemplate', dynamic: str):
+        self.template = template
+        self.dynamic = dynamic
+
+    @property
+    def prefix(self) -> str:
+        return self.template.prefix
+
+    @property
+    def text(self) -> str:
+        return self.template.prefix + self.dynamic
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class PromptTemplate:
+    def __init__(self, name: str, prefix: str, suffix: str):
+        # 固定的前綴只建立一次，每次出題只格式化結尾的變動部分
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def render(self, **values) -> RenderedPrompt:
+        return RenderedPrompt(self, self.suffix.format(**values))
+
+
+_templates: Dict[str, PromptTemplate] = {}
+
+
+def register_template(template: PromptTemplate) -> PromptTemplate:
+    _templates[template.name] = template
+    return template
+
+
+def templates() -> Dict[str, PromptTemplate]:
+    return dict(_templates)
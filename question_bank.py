@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from settings import env_float, env_int
+from sqlite_executor import SQLiteExecutor
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    target TEXT NOT NULL DEFAULT '',
+    content_hash TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    served INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_scope ON questions (subject, scope, served);
+CREATE INDEX IF NOT EXISTS idx_questions_target ON questions (subject, target);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seen (
+    user_id INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (user_id, content_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_seen_time ON seen (seen_at);
+"""
+
+SCHEMA_VERSION = 1
+
+
+def content_hash(question: Dict) -> str:
+    # 題號由模型隨意編排，不影響題目內容
+    body = {k: v for k, v in question.items() if k != '題號'}
+    raw = json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class QuestionBank:
+    def __init__(self, path: str, max_serves: int = 20, seen_ttl: float = 30 * 86400.0):
+        self.path = path
+        self.max_serves = max_serves
+        self.seen_ttl = seen_ttl
+        self.executor = SQLiteExecutor('question-bank', "寫入題庫時發生錯誤")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        version = self.get_meta('schema_version')
+        if version is None:
+            self.set_meta('schema_version', str(SCHEMA_VERSION))
+        elif int(version) > SCHEMA_VERSION:
+            # 較新版本的建置工具產生的題庫，舊程式無法保證讀取正確
+            raise RuntimeError(f"題庫檔案 {path} 的版本為 {version}，此版本的程式僅支援到 {SCHEMA_VERSION}")
+        # 出題紀錄只需保留一段時間，過期後同一題可以再出給同一位使用者
+        self._conn.execute("DELETE FROM seen WHERE seen_at < ?", (time.time() - self.seen_ttl,))
+        self._conn.commit()
+
+    def _locked(self, func, *args, **kwargs):
+        with self._lock:
+            return func(*args, **kwargs)
+
+    async def call(self, func, *args, **kwargs):
+        return await self.executor.call(self._locked, func, *args, **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        self.executor.submit(self._locked, func, *args, **kwargs)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self._conn.commit()
+
+    def add(self, subject: str, scope: str, questions: Iterable[Dict], target_key: Optional[str] = None) -> int:
+        now = time.time()
+        rows = []
+        for q in questions:
+            target = str(q.get(target_key, '')).strip().lower() if target_key else ''
+            rows.append((subject, scope, target, content_hash(q), json.dumps(q, ensure_ascii=False), now))
+        if not rows:
+            return 0
+        before = self._conn.total_changes
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO questions (subject, scope, target, content_hash, payload, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._conn.commit()
+        return self._conn.total_changes - before
+
+    def mark_seen(self, user_id: int, questions: Iterable[Dict]):
+        self._mark_hashes(user_id, [content_hash(q) for q in questions])
+
+    def _mark_hashes(self, user_id: int, hashes: List[str]):
+        if not hashes:
+            return
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO seen (user_id, content_hash, seen_at) VALUES (?, ?, ?)",
+            [(user_id, h, now) for h in hashes],
+        )
+        self._conn.commit()
+
+    def seen_hashes(self, user_id: int, hashes: Iterable[str]) -> Set[str]:
+        wanted = list(set(hashes))
+        seen: Set[str] = set()
+        # SQLite 單一查詢的參數數量有上限，分批查詢
+        for i in range(0, len(wanted), 500):
+            chunk = wanted[i:i + 500]
+            seen.update(row[0] for row in self._conn.execute(
+                f"SELECT content_hash FROM seen WHERE user_id = ? AND content_hash IN ({','.join('?' * len(chunk))})",
+                (user_id, *chunk),
+            ))
+        return seen
+
+    def sample(
+        self,
+        subject: str,
+        count: int,
+        scope: Optional[str] = None,
+        exclude_targets: Iterable[str] = (),
+        user_id: Optional[int] = None,
+    ) -> List[Dict]:
+        if count <= 0:
+            return []
+        sql = "SELECT id, target, content_hash, payload FROM questions WHERE subject = ? AND served < ?"
+        params: list = [subject, self.max_serves]
+        if user_id is not None:
+            # 同一位使用者已經拿過的題目不再提供，沒有新題目時由呼叫端改為生成
+            sql += " AND content_hash NOT IN (SELECT content_hash FROM seen WHERE user_id = ?)"
+            params.append(user_id)
+        if scope is not None:
+            sql += " AND scope = ?"
+            params.append(scope)
+        excluded = [t.lower() for t in exclude_targets if t]
+        if excluded:
+            sql += f" AND target NOT IN ({','.join('?' * len(excluded))})"
+            params.extend(excluded)
+        # 優先提供被使用次數較少的題目，同次數時隨機
+        sql += " ORDER BY served, RANDOM() LIMIT ?"
+        params.append(count * 2)
+        picked: List[Dict] = []
+        ids: List[int] = []
+        hashes: List[str] = []
+        seen_targets = set()
+        for row_id, target, digest, payload in self._conn.execute(sql, params):
+            if target and target in seen_targets:
+                continue
+            seen_targets.add(target)
+            ids.append(row_id)
+            hashes.append(digest)
+            picked.append(json.loads(payload))
+            if len(picked) >= count:
+                break
+        self._record_served(ids, user_id, hashes)
+        return picked
+
+    def _record_served(self, ids: List[int], user_id: Optional[int], hashes: List[str]):
+        if ids:
+            self._conn.executemany("UPDATE questions SET served = served + 1 WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+        if user_id is not None:
+            self._mark_hashes(user_id, hashes)
+
+    def for_targets(self, subject: str, targets: Iterable[str], user_id: Optional[int] = None) -> Dict[str, Dict]:
+        wanted = list({t.strip().lower() for t in targets if t and t.strip()})
+        if not wanted:
+            return {}
+        # 每個目標取一題被使用次數最少、且該使用者沒看過的題目
+        sql = (
+            f"SELECT id, target, content_hash, payload FROM questions WHERE subject = ? AND served < ? "
+            f"AND target IN ({','.join('?' * len(wanted))})"
+        )
+        params: list = [subject, self.max_serves, *wanted]
+        if user_id is not None:
+            sql += " AND content_hash NOT IN (SELECT content_hash FROM seen WHERE user_id = ?)"
+            params.append(user_id)
+        picked: Dict[str, Dict] = {}
+        ids: List[int] = []
+        hashes: List[str] = []
+        for row_id, target, digest, payload in self._conn.execute(sql + " ORDER BY served", params):
+            if target in picked:
+                continue
+            picked[target] = json.loads(payload)
+            ids.append(row_id)
+            hashes.append(digest)
+        self._record_served(ids, user_id, hashes)
+        return picked
+
+    def targets(self, subject: str) -> Set[str]:
+        return {row[0] for row in self._conn.execute(
+            "SELECT DISTINCT target FROM questions WHERE subject = ? AND target != ''", (subject,)
+        )}
+
+    def count(self, subject: str, scope: Optional[str] = None) -> int:
+        if scope is None:
+            row = self._conn.execute("SELECT COUNT(*) FROM questions WHERE subject = ?", (subject,)).fetchone()
+        else:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE subject = ? AND scope = ?", (subject, scope)
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        self.executor.shutdown()
+        self._conn.close()
+
+
+_bank: Optional[QuestionBank] = None
+
+
+def get_bank() -> QuestionBank:
+    global _bank
+    if _bank is None:
+        _bank = QuestionBank(
+            os.getenv('QUESTION_BANK_PATH', 'question_bank.sqlite3'),
+            max_serves=env_int('QUESTION_BANK_MAX_SERVES', 20),
+            seen_ttl=env_float('QUESTION_BANK_SEEN_DAYS', 30.0) * 86400,
+        )
+    return _bank
+
+
+def mark_seen(user_id: int, questions: List[Dict]):
+    # 記下出給這位使用者的題目，之後抽題時略過；寫入在背景進行
+    bank = get_bank()
+    bank.submit(bank.mark_seen, user_id, list(questions))
@@ -0,0 +1,112 @@
+import random
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class _Variants:
+    __slots__ = ('questions', 'expires_at')
+
+    def __init__(self, expires_at: float):
+        self.questions: List[Dict] = []
+        self.expires_at = expires_at
+
+
+class WordQuestionCache:
+    def __init__(self, max_questions: int = 20000, variants_per_word: int = 3, ttl: float = 86400.0):
+        self.max_questions = max(0, max_questions)
+        self.variants_per_word = max(1, variants_per_word)
+        self.ttl = ttl
+        self._words: 'OrderedDict[str, _Variants]' = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(word: str) -> str:
+        return word.strip().lower()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _remove(self, key: str):
+        entry = self._words.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.questions)
+
+    def get(self, word: str, skip: Optional[Callable[[Dict], bool]] = None) -> Optional[Dict]:
+        key = self._key(word)
+        entry = self._words.get(key)
+        if entry is None or entry.expires_at < time.time():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        # skip 用來排除使用者已經作答過的版本
+        candidates = [q for q in entry.questions if skip is None or not skip(q)]
+        if not candidates:
+            self.misses += 1
+            return None
+        self._words.move_to_end(key)
+        self.hits += 1
+        return random.choice(candidates)
+
+    def variants(self, words: Sequence[str]) -> List[Dict]:
+        # 列出這些單字目前快取的所有版本，讓呼叫端一次查好使用者看過哪些
+        now = time.time()
+        found: List[Dict] = []
+        for word in words:
+            entry = self._words.get(self._key(word))
+            if entry is not None and entry.expires_at >= now:
+                found.extend(entry.questions)
+        return found
+
+    def lookup(self, words: Sequence[str], skip: Optional[Callable[[Dict], bool]] = None) -> Tuple[List[Dict], List[str]]:
+        found: List[Dict] = []
+        missing: List[str] = []
+        for word in words:
+            question = self.get(word, skip)
+            if question is None:
+                missing.append(word)
+            else:
+                found.append(question)
+        return found, missing
+
+    def put(self, word: str, question: Dict):
+        if self.max_questions <= 0:
+            return
+        key = self._key(word)
+        if not key:
+            return
+        entry = self._words.get(key)
+        now = time.time()
+        if entry is None or entry.expires_at < now:
+            self._remove(key)
+            entry = self._words[key] = _Variants(now + self.ttl)
+        stem = question.get('題目')
+        if any(q.get('題目') == stem for q in entry.questions):
+            self._words.move_to_end(key)
+            return
+        entry.questions.append(question)
+        self._size += 1
+        if len(entry.questions) > self.variants_per_word:
+            # 保留最新的幾個版本，讓熱門單字的題目仍會輪替
+            entry.questions.pop(0)
+            self._size -= 1
+        self._words.move_to_end(key)
+        while self._size > self.max_questions and self._words:
+            _, evicted = self._words.popitem(last=False)
+            self._size -= len(evicted.questions)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'words': len(self._words),
+            'questions': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+        }
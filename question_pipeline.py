@@ -0,0 +1,88 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, TypeVar
+
+from llm_json import OPTION_KEYS, is_valid_question
+from settings import env_float
+from word_forms import contains_form, word_forms
+
+
+T = TypeVar('T')
+DEFAULT_BUDGET = env_float('GENERATION_BUDGET', 45.0)
+
+
+def generation_budget(timeout: Optional[float] = None) -> float:
+    # 互動剩餘時間通常遠長於生成預算，兩者取較短者，GENERATION_BUDGET 才會真正生效
+    return DEFAULT_BUDGET if timeout is None else min(DEFAULT_BUDGET, timeout)
+
+
+def has_duplicate_options(question: Dict) -> bool:
+    options = question.get('選項', {})
+    values = [str(options.get(k, '')).strip().lower() for k in OPTION_KEYS]
+    return len(set(values)) != len(values)
+
+
+def options_contain(question: Dict, word: str, forms: Optional[Iterable[str]] = None) -> bool:
+    # 以完整單字比對詞形變化（blur -> blurring、go -> went），不比對字串片段
+    forms = word_forms(word) if forms is None else forms
+    return any(contains_form(str(v), forms) for v in question.get('選項', {}).values())
+
+
+def question_problems(
+    question: Dict,
+    explanation_key: str = '詳解',
+    target: Optional[str] = None,
+    require_stem: bool = True,
+    target_forms: Optional[Iterable[str]] = None,
+) -> List[str]:
+    if not is_valid_question(question, explanation_key, require_stem):
+        return ['格式不符']
+    problems = []
+    if has_duplicate_options(question):
+        problems.append('選項重複')
+    if target and not options_contain(question, target, target_forms):
+        problems.append('選項未包含測驗單字')
+    return problems
+
+
+async def generate_with_backfill(
+    items: Sequence[T],
+    request: Callable[[List[T], float], Awaitable[List[Dict]]],
+    validate: Callable[[Dict], bool],
+    match: Callable[[Dict, List[T]], Optional[T]],
+    budget: float,
+    max_attempts: int = 3,
+    base_delay: float = 0.5,
+) -> List[Dict]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    remaining = list(items)
+    accepted: List[Dict] = []
+    attempt = 0
+    while remaining and attempt < max_attempts:
+        time_left = deadline - loop.time()
+        if time_left <= 0:
+            break
+        try:
+            produced = await asyncio.wait_for(request(list(remaining), time_left), timeout=time_left)
+        except asyncio.TimeoutError:
+            break
+        except Exception as e:
+            print(f"生成題目時發生錯誤（第 {attempt + 1} 次）: {e}")
+            produced = []
+        for question in produced:
+            if not remaining:
+                break
+            if not validate(question):
+                continue
+            item = match(question, remaining)
+            if item is None:
+                continue
+            remaining.remove(item)
+            accepted.append(question)
+        attempt += 1
+        if remaining and attempt < max_attempts:
+            # 只針對缺少的項目重試，並以指數退避避免連續打爆配額
+            delay = min(base_delay * (2 ** (attempt - 1)), deadline - loop.time())
+            if delay > 0:
+                await asyncio.sleep(delay)
+    return accepted
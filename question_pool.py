@@ -0,0 +1,119 @@
+import asyncio
+import random
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional
+
+
+class QuestionPool:
+    def __init__(
+        self,
+        levels: Iterable[int],
+        generate: Callable[[int, int], Awaitable[Optional[List[Dict]]]],
+        capacity: int = 40,
+        low_water: int = 15,
+        batch_size: int = 10,
+        idle_interval: float = 5.0,
+    ):
+        self.levels = list(levels)
+        self._generate = generate
+        self.capacity = capacity
+        self.low_water = min(low_water, capacity)
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self._pools: Dict[int, Deque[Dict]] = {lv: deque() for lv in self.levels}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.refill_deferred = 0
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._refill_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def depth(self, level: Optional[int] = None) -> int:
+        if level is not None:
+            return len(self._pools.get(level, ()))
+        return sum(len(p) for p in self._pools.values())
+
+    def take(self, count: int, level: Optional[int] = None) -> List[Dict]:
+        taken: List[Dict] = []
+        if level is not None:
+            pool = self._pools.get(level)
+            while pool and len(taken) < count:
+                taken.append(pool.popleft())
+        else:
+            # 未指定級別時，從仍有存量的級別中隨機抽取
+            while len(taken) < count:
+                candidates = [p for p in self._pools.values() if p]
+                if not candidates:
+                    break
+                taken.append(random.choice(candidates).popleft())
+        self.hits += len(taken)
+        self.misses += count - len(taken)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return taken
+
+    def put(self, level: int, questions: List[Dict]):
+        pool = self._pools.setdefault(level, deque())
+        for q in questions:
+            if len(pool) >= self.capacity:
+                break
+            pool.append(q)
+
+    def stats(self) -> Dict:
+        requested = self.hits + self.misses
+        return {
+            'depth': {lv: len(p) for lv, p in self._pools.items()},
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / requested) if requested else 0.0,
+            'refills': self.refills,
+            'refill_errors': self.refill_errors,
+            'refill_deferred': self.refill_deferred,
+        }
+
+    def _next_level_to_refill(self) -> Optional[int]:
+        low = [lv for lv in self.levels if len(self._pools[lv]) < self.low_water]
+        if not low:
+            return None
+        return min(low, key=lambda lv: len(self._pools[lv]))
+
+    async def _refill_loop(self):
+        while True:
+            level = self._next_level_to_refill()
+            if level is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            want = min(self.batch_size, self.capacity - len(self._pools[level]))
+            try:
+                questions = await self._generate(level, want)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"補充題庫池時發生錯誤（級別 {level}）: {e}")
+                questions = []
+            if questions is None:
+                # 沒有空閒額度時暫緩補題，這是正常的限流結果而不是錯誤
+                self.refill_deferred += 1
+                await asyncio.sleep(self.idle_interval)
+            elif questions:
+                self.put(level, questions)
+                self.refills += 1
+            else:
+                self.refill_errors += 1
+                await asyncio.sleep(self.idle_interval)
@@ -0,0 +1,308 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+import discord
+
+from gemini_client import interaction_timeout
+from settings import env_float, env_int
+
+
+QUEUE_TIMEOUT = env_float('RATE_QUEUE_TIMEOUT', 120.0)
+
+# 放行時取得的全域令牌，抵用同一個任務（及其衍生任務）的第一次模型呼叫
+_prepaid: ContextVar[Optional[List[int]]] = ContextVar('generation_prepaid', default=None)
+
+
+class RateLimited(Exception):
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def retry_after(self) -> float:
+        self._refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        global_rate: float,
+        global_burst: int,
+        guild_rate: float,
+        guild_burst: int,
+        user_rate: float,
+        user_burst: int,
+        max_queue: int = 20,
+        max_buckets: int = 10000,
+        status_interval: float = 2.0,
+        background_reserve: float = 2.0,
+    ):
+        self._global = TokenBucket(global_rate, global_burst)
+        self._guild_args = (guild_rate, guild_burst)
+        self._user_args = (user_rate, user_burst)
+        self._guilds: Dict[int, TokenBucket] = {}
+        self._users: Dict[int, TokenBucket] = {}
+        self.max_queue = max(0, max_queue)
+        self.max_buckets = max_buckets
+        self.status_interval = status_interval
+        self.background_reserve = background_reserve
+        self._queue: Deque[asyncio.Future] = deque()
+        self._pump: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.rejected = 0
+        self.queued = 0
+        self.speculative = 0
+        self.charged = 0
+        self.released = 0
+
+    def _bucket(self, buckets: Dict[int, TokenBucket], key: int, args) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_buckets:
+                # 已回滿的桶與新建的桶等價，可以直接丟掉
+                for k in [k for k, b in buckets.items() if b.idle]:
+                    del buckets[k]
+            bucket = buckets[key] = TokenBucket(*args)
+        return bucket
+
+    def _reject(self, message: str, retry_after: float, *refunds: Optional[TokenBucket]):
+        for bucket in refunds:
+            if bucket is not None:
+                bucket.refund()
+        self.rejected += 1
+        raise RateLimited(message, retry_after)
+
+    def try_background(self) -> bool:
+        # 背景補題只使用空閒額度，不與排隊中的使用者搶，並保留幾個令牌給下一位開始測驗的使用者
+        reserve = min(self.background_reserve, self._global.capacity - 1)
+        if self._queue or self._global.available() < 1 + reserve or not self._global.try_take():
+            return False
+        _prepaid.set([1])
+        return True
+
+    def try_speculative(self, user_id: int, reserve: float = 2.0) -> bool:
+        # 預先生成只在全域與使用者都還留有額度時進行，不佔用第一次開始測驗的名額
+        if self._queue or self._global.available() < 1 + reserve:
+            return False
+        user = self._bucket(self._users, user_id, self._user_args)
+        if user.available() < 2 or not user.try_take():
+            return False
+        if not self._global.try_take():
+            user.refund()
+            return False
+        _prepaid.set([1])
+        self.speculative += 1
+        return True
+
+    async def acquire(
+        self,
+        user_id: int,
+        guild_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int, float], Awaitable]] = None,
+        timeout: Optional[float] = None,
+    ):
+        user = self._bucket(self._users, user_id, self._user_args)
+        if not user.try_take():
+            self._reject("你的生成請求太頻繁，請稍後再試。", user.retry_after())
+        guild = None
+        if guild_id is not None:
+            guild = self._bucket(self._guilds, guild_id, self._guild_args)
+            if not guild.try_take():
+                self._reject("此伺服器目前的生成請求太多，請稍後再試。", guild.retry_after(), user)
+        if not self._queue and self._global.try_take():
+            _prepaid.set([1])
+            self.admitted += 1
+            return
+        if len(self._queue) >= self.max_queue:
+            self._reject("目前排隊人數已滿，請稍後再試。", self.estimated_wait(len(self._queue)), user, guild)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append(future)
+        self.queued += 1
+        self._ensure_pump()
+        deadline = None if timeout is None else loop.time() + timeout
+        reported = None
+        try:
+            while not future.done():
+                position = self._position(future)
+                if on_queued is not None and position != reported:
+                    # 隊伍前進時更新使用者看到的名次與預估時間
+                    reported = position
+                    try:
+                        await on_queued(position, self.estimated_wait(position))
+                    except Exception as e:
+                        print(f"更新排隊狀態時發生錯誤: {e}")
+                wait = self.status_interval
+                if deadline is not None:
+                    wait = min(wait, deadline - loop.time())
+                    if wait <= 0:
+                        raise asyncio.TimeoutError
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=wait)
+                except asyncio.TimeoutError:
+                    continue
+        except asyncio.TimeoutError:
+            self._reject("排隊等候逾時，請稍後再試。", 0.0, user, guild)
+        except asyncio.CancelledError:
+            # 等待的任務被取消（例如互動已結束）時退回已扣的額度，已放行的全域令牌也一併退回
+            for bucket in (user, guild):
+                if bucket is not None:
+                    bucket.refund()
+            if future.done() and not future.cancelled():
+                self._global.refund()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+        _prepaid.set([1])
+        self.admitted += 1
+
+    async def charge(self):
+        # 每次實際呼叫模型都消耗全域令牌：放行時的令牌抵用第一次呼叫，補題重試、重複請求與改用其他後端另外扣
+        ticket = _prepaid.get()
+        if ticket and ticket[0] > 0:
+            ticket[0] -= 1
+            return
+        self.charged += 1
+        if not self._queue and self._global.try_take():
+            return
+        # 額外的呼叫與使用者排在同一個隊伍，不插隊搶走排隊中使用者的令牌
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(future)
+        self._ensure_pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._global.refund()
+            raise
+
+    def release_unused(self):
+        # 放行後沒有實際呼叫模型（例如併入其他使用者的合併批次）時退回令牌，合併的請求只扣一次
+        ticket = _prepaid.get()
+        if ticket and ticket[0] > 0:
+            ticket[0] = 0
+            self._global.refund()
+            self.released += 1
+
+    def _position(self, future: asyncio.Future) -> int:
+        position = 0
+        for waiting in self._queue:
+            if waiting.done():
+                continue
+            position += 1
+            if waiting is future:
+                break
+        return max(position, 1)
+
+    def estimated_wait(self, position: int) -> float:
+        rate = self._global.rate
+        if rate <= 0:
+            return math.inf
+        return self._global.retry_after() + max(position - 1, 0) / rate
+
+    def _ensure_pump(self):
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.ensure_future(self._pump_loop())
+
+    async def _pump_loop(self):
+        # 依令牌補充速度依序放行排隊中的請求
+        while self._queue:
+            head = self._queue[0]
+            if head.done():
+                self._queue.popleft()
+                continue
+            if self._global.try_take():
+                self._queue.popleft().set_result(None)
+                continue
+            await asyncio.sleep(max(self._global.retry_after(), 0.01))
+
+    def stats(self) -> Dict:
+        return {
+            'queue': len(self._queue),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'speculative': self.speculative,
+            'charged': self.charged,
+            'released': self.released,
+        }
+
+
+async def send_status(interaction: discord.Interaction, content: str):
+    if interaction.response.is_done():
+        await interaction.edit_original_response(content=content)
+    else:
+        await interaction.response.send_message(content)
+
+
+async def send_rejection(interaction: discord.Interaction, message: str):
+    if interaction.response.is_done():
+        await interaction.edit_original_response(content=message)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+
+
+async def admit(interaction: discord.Interaction, timeout: Optional[float] = None):
+    async def on_queued(position: int, wait: float):
+        await send_status(interaction, f"目前生成請求較多，排隊中：第 {position} 位，預計約 {math.ceil(wait)} 秒後開始生成...")
+
+    await generation_limiter.acquire(
+        interaction.user.id,
+        interaction.guild_id,
+        on_queued=on_queued,
+        timeout=min(QUEUE_TIMEOUT, interaction_timeout(interaction), timeout or QUEUE_TIMEOUT),
+    )
+
+
+generation_limiter = RateLimiter(
+    global_rate=env_float('RATE_GLOBAL_PER_MINUTE', 15.0) / 60.0,
+    global_burst=env_int('RATE_GLOBAL_BURST', 5),
+    guild_rate=env_float('RATE_GUILD_PER_MINUTE', 6.0) / 60.0,
+    guild_burst=env_int('RATE_GUILD_BURST', 3),
+    user_rate=env_float('RATE_USER_PER_MINUTE', 2.0) / 60.0,
+    user_burst=env_int('RATE_USER_BURST', 2),
+    max_queue=env_int('RATE_QUEUE_MAX', 20),
+    status_interval=env_float('RATE_QUEUE_STATUS_INTERVAL', 2.0),
+    background_reserve=env_float('RATE_BACKGROUND_RESERVE', 2.0),
+)
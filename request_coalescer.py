@@ -0,0 +1,202 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+class RequestCoalescer:
+    def __init__(
+        self,
+        generate: Callable[[List[str]], Awaitable[List[Dict]]],
+        key: Callable[[Dict], str],
+        window: float = 0.1,
+        max_batch: int = 30,
+    ):
+        self._generate = generate
+        self._key = key
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_words = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 保留執行中批次的參照，避免事件迴圈只持有弱參照時被回收
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.coalesced_requests = 0
+
+    async def submit(self, words: List[str], timeout: Optional[float] = None) -> List[Dict]:
+        if not words:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(words), future))
+        self._pending_words += len(words)
+        if self._pending_words >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        # 單一請求逾時不應中斷整批生成，其他等待者仍需要結果
+        return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        self._pending_words = 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[List[str], asyncio.Future]], error: BaseException):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        self.batches += 1
+        self.coalesced_requests += len(batch)
+        all_words: List[str] = []
+        seen = set()
+        for words, _ in batch:
+            for w in words:
+                if w.lower() not in seen:
+                    seen.add(w.lower())
+                    all_words.append(w)
+        try:
+            questions = await self._generate(all_words)
+        except asyncio.CancelledError:
+            # 批次被取消時仍要通知所有等待者，否則它們會一直等到各自逾時
+            self._fail(batch, RuntimeError("合併的生成請求已取消"))
+            raise
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        by_word: Dict[str, List[Dict]] = {}
+        unmatched: List[Dict] = []
+        for q in questions:
+            k = self._key(q)
+            if k in seen:
+                by_word.setdefault(k, []).append(q)
+            else:
+                unmatched.append(q)
+        results: List[List[Dict]] = []
+        for words, _ in batch:
+            picked = []
+            for w in words:
+                matches = by_word.get(w.lower())
+                if matches:
+                    # 同一單字被多人請求時，題目不足就共用同一題
+                    picked.append(matches.pop() if len(matches) > 1 else matches[0])
+            results.append(picked)
+        # 模型未標明或改寫了測驗單字的題目，分給仍不足題數的請求
+        for (words, _), picked in zip(batch, results):
+            while unmatched and len(picked) < len(words):
+                picked.append(unmatched.pop())
+        for (_, future), picked in zip(batch, results):
+            if not future.done():
+                future.set_result(picked)
+
+
+_DONE = object()
+
+
+class _Subscriber:
+    __slots__ = ('remaining', 'timeout', 'queue', 'closed')
+
+    def __init__(self, words: List[str], timeout: Optional[float]):
+        self.remaining = list(words)
+        self.timeout = timeout
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.closed = False
+
+
+class StreamCoalescer:
+    def __init__(
+        self,
+        stream: Callable[[List[str], Optional[float]], AsyncIterator[Dict]],
+        match: Callable[[Dict, List[str]], Optional[str]],
+        window: float = 0.1,
+        max_batch: int = 30,
+    ):
+        self._stream = stream
+        self._match = match
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[_Subscriber] = []
+        self._pending_words = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Dict[asyncio.Task, List[_Subscriber]] = {}
+        self.batches = 0
+        self.coalesced_requests = 0
+
+    async def stream(self, words: List[str], timeout: Optional[float] = None) -> AsyncIterator[Dict]:
+        if not words:
+            return
+        subscriber = _Subscriber(words, timeout)
+        self._pending.append(subscriber)
+        self._pending_words += len(words)
+        if self._pending_words >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        try:
+            while True:
+                question = await subscriber.queue.get()
+                if question is _DONE:
+                    return
+                yield question
+        finally:
+            subscriber.closed = True
+            self._leave(subscriber)
+
+    def _leave(self, subscriber: _Subscriber):
+        if subscriber in self._pending:
+            self._pending.remove(subscriber)
+            self._pending_words -= len(subscriber.remaining)
+            return
+        # 同一批的使用者都已放棄（例如改由單字表出題）時停止整批串流
+        for task, batch in self._tasks.items():
+            if subscriber in batch:
+                if all(s.closed for s in batch):
+                    task.cancel()
+                return
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        self._pending_words = 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks[task] = batch
+            task.add_done_callback(lambda t: self._tasks.pop(t, None))
+
+    async def _run(self, batch: List[_Subscriber]):
+        self.batches += 1
+        self.coalesced_requests += len(batch)
+        all_words: List[str] = []
+        seen = set()
+        for subscriber in batch:
+            for w in subscriber.remaining:
+                if w.lower() not in seen:
+                    seen.add(w.lower())
+                    all_words.append(w)
+        timeouts = [s.timeout for s in batch]
+        timeout = None if None in timeouts else max(timeouts)
+        try:
+            # 整批只開一個串流，每完成一題就分給需要該單字的使用者
+            async for question in self._stream(all_words, timeout):
+                for subscriber in batch:
+                    if subscriber.closed:
+                        continue
+                    word = self._match(question, subscriber.remaining)
+                    if word is not None:
+                        subscriber.remaining.remove(word)
+                        subscriber.queue.put_nowait(question)
+        except Exception as e:
+            print(f"合併串流生成題目時發生錯誤: {e}")
+        finally:
+            for subscriber in batch:
+                subscriber.queue.put_nowait(_DONE)
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Generic, Optional, TypeVar
+
+
+T = TypeVar('T')
+
+
+class LazyResource(Generic[T]):
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> T:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+    def set(self, value: T):
+        # 以外部已載入的資料取代預設來源，例如建置工具指定的單字表
+        with self._lock:
+            self._value = value
+            self._loaded = True
+
+    async def load_async(self) -> T:
+        if self._loaded:
+            return self._value
+        # 讀檔等阻塞工作放到執行緒，避免卡住事件迴圈
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get)
+
+
+_warmups: Dict[str, Callable[[], Awaitable[None]]] = {}
+
+
+def register_warmup(name: str, warm_up: Callable[[], Awaitable[None]]):
+    _warmups[name] = warm_up
+
+
+async def warm_up_all():
+    for name, warm_up in list(_warmups.items()):
+        start = time.perf_counter()
+        try:
+            await warm_up()
+            print(f"{name} 預熱完成（{time.perf_counter() - start:.2f} 秒）")
+        except Exception as e:
+            print(f"{name} 預熱時發生錯誤: {e}")
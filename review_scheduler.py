@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from settings import env_float
+from sqlite_executor import SQLiteExecutor
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    item TEXT NOT NULL,
+    correct INTEGER NOT NULL,
+    answered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_user ON answers (user_id, answered_at);
+CREATE TABLE IF NOT EXISTS review_items (
+    user_id INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    item TEXT NOT NULL,
+    level INTEGER,
+    ease REAL NOT NULL,
+    interval REAL NOT NULL,
+    reps INTEGER NOT NULL,
+    lapses INTEGER NOT NULL,
+    due_at REAL NOT NULL,
+    PRIMARY KEY (user_id, subject, item)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_review_due ON review_items (user_id, subject, due_at);
+"""
+
+DAY = 86400.0
+MIN_EASE = 1.3
+
+
+def next_review(ease: float, interval: float, reps: int, correct: bool, relearn_delay: float) -> Tuple[float, float, int]:
+    # SM-2 的簡化版：答對時拉長間隔，答錯時回到短間隔重新學習
+    if not correct:
+        return max(MIN_EASE, ease - 0.2), relearn_delay, 0
+    reps += 1
+    if reps == 1:
+        interval = DAY
+    elif reps == 2:
+        interval = 6 * DAY
+    else:
+        interval = interval * ease
+    return ease + 0.1, interval, reps
+
+
+class ReviewScheduler:
+    def __init__(self, path: str, relearn_delay: float = 600.0):
+        self.path = path
+        self.relearn_delay = relearn_delay
+        # 作答紀錄先暫存在記憶體，由單一背景執行緒批次寫入，按鈕回應不必等待磁碟
+        self.executor = SQLiteExecutor('review-scheduler', "寫入作答紀錄時發生錯誤")
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[int, str, str, bool, Optional[int], float]] = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    async def call(self, func, *args, **kwargs):
+        return await self.executor.call(func, *args, **kwargs)
+
+    def record(self, user_id: int, subject: str, item: str, correct: bool, level: Optional[int] = None):
+        item = item.strip().lower()
+        if not item:
+            return
+        with self._lock:
+            self._pending.append((user_id, subject, item, correct, level, time.time()))
+            if len(self._pending) > 1:
+                # 已經排定寫入，這筆會一起寫入
+                return
+        self.executor.submit(self.flush)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        # 同一批紀錄在一個交易內寫入，只需提交一次
+        with self._conn:
+            for user_id, subject, item, correct, level, now in pending:
+                self._write(user_id, subject, item, correct, level, now)
+
+    def _write(self, user_id: int, subject: str, item: str, correct: bool, level: Optional[int], now: float):
+        self._conn.execute(
+            "INSERT INTO answers (user_id, subject, item, correct, answered_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, subject, item, int(correct), now),
+        )
+        row = self._conn.execute(
+            "SELECT ease, interval, reps, lapses FROM review_items WHERE user_id = ? AND subject = ? AND item = ?",
+            (user_id, subject, item),
+        ).fetchone()
+        ease, interval, reps, lapses = row if row else (2.5, 0.0, 0, 0)
+        ease, interval, reps = next_review(ease, interval, reps, correct, self.relearn_delay)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO review_items (user_id, subject, item, level, ease, interval, reps, lapses, due_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, subject, item, level, ease, interval, reps, lapses + (0 if correct else 1), now + interval),
+        )
+
+    def due(self, user_id: int, subject: str, limit: int, level: Optional[int] = None) -> List[str]:
+        if limit <= 0:
+            return []
+        # 先寫入尚未落盤的作答，剛答錯的單字才會出現在複習清單
+        self.flush()
+        # 依 (user_id, subject, due_at) 索引由最早到期的開始讀，不需掃描作答紀錄
+        sql = "SELECT item FROM review_items WHERE user_id = ? AND subject = ? AND due_at <= ?"
+        params: list = [user_id, subject, time.time()]
+        if level is not None:
+            sql += " AND level = ?"
+            params.append(level)
+        sql += " ORDER BY due_at LIMIT ?"
+        params.append(limit)
+        return [row[0] for row in self._conn.execute(sql, params)]
+
+    def summary(self, user_id: int, subject: str) -> Dict:
+        self.flush()
+        row = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(due_at <= ?), 0), COALESCE(SUM(reps >= 3), 0) "
+            "FROM review_items WHERE user_id = ? AND subject = ?",
+            (time.time(), user_id, subject),
+        ).fetchone()
+        return {'seen': row[0], 'due': row[1], 'learned': row[2]}
+
+    def close(self):
+        self.executor.shutdown()
+        self.flush()
+        self._conn.close()
+
+
+_scheduler: Optional[ReviewScheduler] = None
+
+
+def get_scheduler() -> ReviewScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ReviewScheduler(
+            os.getenv('REVIEW_DB_PATH', 'reviews.sqlite3'),
+            relearn_delay=env_float('REVIEW_RELEARN_DELAY', 600.0),
+        )
+    return _scheduler
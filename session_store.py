@@ -0,0 +1,273 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, Generic, Iterator, List, Optional, TypeVar
+
+from metrics import session_timeouts
+from settings import env_float, env_int
+from sqlite_executor import SQLiteExecutor
+
+
+S = TypeVar('S')
+
+ACTIVE_MESSAGE = "你已經有一個進行中的測驗！請先完成或等待超時。"
+FULL_MESSAGE = "目前進行中的測驗過多，請稍後再試。"
+
+
+class SessionRejected(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ('state', 'expires_at', 'shard_id')
+
+    def __init__(self, state, expires_at: float, shard_id: int = 0):
+        self.state = state
+        self.expires_at = expires_at
+        self.shard_id = shard_id
+
+
+class LocalBackend:
+    executor = None
+
+    def claim(self, namespace: str, user_id: int, expires_at: float) -> bool:
+        return True
+
+    def refresh(self, namespace: str, user_id: int, expires_at: float):
+        pass
+
+    def release(self, namespace: str, user_id: int):
+        pass
+
+    def count(self, namespace: str) -> Optional[int]:
+        return None
+
+
+class SQLiteBackend:
+    def __init__(self, path: str):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.executor = SQLiteExecutor('session-store', "更新共用測驗紀錄時發生錯誤")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, user_id INTEGER NOT NULL, owner TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (namespace, user_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expiry ON sessions (expires_at)")
+
+    def claim(self, namespace: str, user_id: int, expires_at: float) -> bool:
+        # 只有在沒有紀錄、紀錄已過期或本來就屬於本行程時才能取得
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO sessions (namespace, user_id, owner, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, user_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE sessions.expires_at < ? OR sessions.owner = excluded.owner",
+                (namespace, user_id, self.owner, expires_at, time.time()),
+            )
+            return cur.rowcount > 0
+
+    def refresh(self, namespace: str, user_id: int, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET expires_at = ? WHERE namespace = ? AND user_id = ? AND owner = ?",
+                (expires_at, namespace, user_id, self.owner),
+            )
+
+    def release(self, namespace: str, user_id: int):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM sessions WHERE namespace = ? AND user_id = ? AND owner = ?",
+                (namespace, user_id, self.owner),
+            )
+
+    def count(self, namespace: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE namespace = ? AND expires_at >= ?", (namespace, time.time())
+            ).fetchone()
+        return row[0]
+
+
+class SessionStore(Generic[S]):
+    def __init__(self, namespace: str, backend=None, ttl: float = 600.0, max_sessions: int = 5000, shards: int = 16):
+        self.namespace = namespace
+        self._backend = backend
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._shards: List[Dict[int, _Entry]] = [{} for _ in range(max(1, shards))]
+        self._size = 0
+        self._sweep_cursor = 0
+        self._sweeper: Optional[asyncio.Task] = None
+        self.evicted = 0
+
+    @property
+    def backend(self):
+        # 延後到第一次使用時才開啟共用後端
+        if self._backend is None:
+            self._backend = _get_backend()
+        return self._backend
+
+    async def _call(self, func, *args):
+        executor = self.backend.executor
+        if executor is None:
+            return func(*args)
+        return await executor.call(func, *args)
+
+    def _offload(self, func, *args):
+        # 釋放與更新期限不需要等結果，送到背景執行緒後立即返回
+        executor = self.backend.executor
+        if executor is None:
+            func(*args)
+            return
+        executor.submit(func, *args)
+
+    def _shard(self, user_id: int) -> Dict[int, _Entry]:
+        return self._shards[user_id % len(self._shards)]
+
+    def _live_entry(self, user_id: int) -> Optional[_Entry]:
+        shard = self._shard(user_id)
+        entry = shard.get(user_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.time():
+            self._drop(shard, user_id)
+            self.evicted += 1
+            session_timeouts.inc(subject=self.namespace)
+            return None
+        return entry
+
+    def _drop(self, shard: Dict[int, _Entry], user_id: int):
+        if shard.pop(user_id, None) is not None:
+            self._size -= 1
+        self._offload(self.backend.release, self.namespace, user_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._live_entry(user_id) is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[S]:
+        for shard in self._shards:
+            for entry in list(shard.values()):
+                yield entry.state
+
+    def get(self, user_id: int) -> Optional[S]:
+        entry = self._live_entry(user_id)
+        return entry.state if entry else None
+
+    def is_full(self) -> bool:
+        if self._size < self.max_sessions:
+            return False
+        self.sweep_all()
+        return self._size >= self.max_sessions
+
+    async def claim(self, user_id: int, state: S, shard_id: int = 0):
+        if self._live_entry(user_id) is not None:
+            raise SessionRejected(ACTIVE_MESSAGE)
+        if self.is_full():
+            raise SessionRejected(FULL_MESSAGE)
+        expires_at = time.time() + self.ttl
+        # 先在本機佔位，等待共用後端期間同一位使用者的第二個請求會直接被擋下
+        shard = self._shard(user_id)
+        entry = shard[user_id] = _Entry(state, expires_at, shard_id)
+        self._size += 1
+        try:
+            claimed = await self._call(self.backend.claim, self.namespace, user_id, expires_at)
+        except BaseException:
+            self._discard(shard, user_id, entry)
+            raise
+        if not claimed:
+            # 其他行程（或分片）上已有這位使用者進行中的測驗
+            self._discard(shard, user_id, entry)
+            raise SessionRejected(ACTIVE_MESSAGE)
+
+    def _discard(self, shard: Dict[int, _Entry], user_id: int, entry: _Entry):
+        if shard.get(user_id) is entry:
+            del shard[user_id]
+            self._size -= 1
+
+    def touch(self, user_id: int):
+        entry = self._live_entry(user_id)
+        if entry is not None:
+            entry.expires_at = time.time() + self.ttl
+            self._offload(self.backend.refresh, self.namespace, user_id, entry.expires_at)
+
+    def release(self, user_id: int, state: Optional[S] = None):
+        shard = self._shard(user_id)
+        entry = shard.get(user_id)
+        if entry is None:
+            return
+        # 舊的 View 逾時時不應移除使用者新開始的測驗
+        if state is not None and entry.state is not state:
+            return
+        self._drop(shard, user_id)
+
+    def sweep_shard(self) -> int:
+        shard = self._shards[self._sweep_cursor]
+        self._sweep_cursor = (self._sweep_cursor + 1) % len(self._shards)
+        now = time.time()
+        expired = [uid for uid, entry in shard.items() if entry.expires_at < now]
+        for uid in expired:
+            self._drop(shard, uid)
+        self.evicted += len(expired)
+        if expired:
+            session_timeouts.inc(len(expired), subject=self.namespace)
+        return len(expired)
+
+    def sweep_all(self) -> int:
+        return sum(self.sweep_shard() for _ in self._shards)
+
+    def start_sweeper(self, interval: float = 60.0):
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    async def _sweep_loop(self, interval: float):
+        # 每次只掃一個分片，避免一次掃描全部造成停頓
+        step = interval / len(self._shards)
+        while True:
+            await asyncio.sleep(step)
+            self.sweep_shard()
+
+    def counts_by_shard(self) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for shard in self._shards:
+            for entry in shard.values():
+                counts[entry.shard_id] = counts.get(entry.shard_id, 0) + 1
+        return counts
+
+    def stats(self) -> Dict:
+        return {
+            'active': self._size,
+            'shared_active': self.backend.count(self.namespace),
+            'max': self.max_sessions,
+            'evicted': self.evicted,
+        }
+
+
+_backend = None
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        if os.getenv('SESSION_BACKEND', 'memory').lower() == 'sqlite':
+            _backend = SQLiteBackend(os.getenv('SESSION_DB_PATH', 'sessions.sqlite3'))
+        else:
+            _backend = LocalBackend()
+    return _backend
+
+
+def create_store(namespace: str) -> SessionStore:
+    return SessionStore(
+        namespace,
+        ttl=env_float('SESSION_TTL', 600.0),
+        max_sessions=env_int('SESSION_MAX_ACTIVE', 5000),
+        shards=env_int('SESSION_SHARDS', 16),
+    )
@@ -0,0 +1,47 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable
+
+import discord
+
+
+def shard_for(interaction: discord.Interaction) -> int:
+    guild_id = interaction.guild_id
+    shard_count = getattr(interaction.client, 'shard_count', None) or 1
+    if guild_id is None:
+        # 私訊一律由 0 號分片處理
+        return 0
+    return (guild_id >> 22) % shard_count
+
+
+class ShardMetrics:
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._interactions: Dict[int, Deque[float]] = {}
+        self.totals: Dict[int, int] = {}
+
+    def record_interaction(self, shard_id: int):
+        now = time.monotonic()
+        interactions = self._interactions.setdefault(shard_id, deque())
+        interactions.append(now)
+        self.totals[shard_id] = self.totals.get(shard_id, 0) + 1
+        self._trim(interactions, now)
+
+    def _trim(self, events: Deque[float], now: float):
+        cutoff = now - self.window
+        while events and events[0] < cutoff:
+            events.popleft()
+
+    def interaction_rate(self, shard_id: int) -> float:
+        interactions = self._interactions.get(shard_id)
+        if not interactions:
+            return 0.0
+        # 只統計斜線指令與按鈕等互動，不含其他 gateway 事件
+        self._trim(interactions, time.monotonic())
+        return len(interactions) * 60.0 / self.window
+
+    def shard_ids(self) -> Iterable[int]:
+        return sorted(self._interactions)
+
+
+shard_metrics = ShardMetrics()
@@ -1,13 +1,24 @@
 from discord.ext import commands
 from discord import app_commands
 import discord
-import os
-import random
-import json
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+import time
 from typing import List, Dict, Optional
 
+from curriculum import SUBJECT_NAMES, load_curriculum
+from embed_pages import add_long_field
+from gemini_client import get_client, interaction_timeout
+from llm_json import parse_questions
+from question_pipeline import generate_with_backfill, generation_budget, question_problems
+from metrics import active_sessions, button_latency, first_question_latency
+from prefetch import PREFETCH_AHEAD, PREFETCH_TAKE_TIMEOUT, PREFETCH_TIMEOUT, Prefetcher
+from prompts import PromptTemplate, RenderedPrompt, register_template
+from question_bank import get_bank, mark_seen
+from rate_limiter import RateLimited, admit, send_rejection, send_status
+from resources import LazyResource, register_warmup
+from session_store import SessionRejected, create_store
+from shard_metrics import shard_for
+
 
 SOCIAL_EXAMPLES = (
     "甲和乙兩人在溪邊戲水，乙不慎落水，甲會游泳但見溪流湍急未下水救援，後乙不幸溺斃。\n"
@@ -35,61 +46,48 @@ SOCIAL_EXAMPLES = (
     "(D)古文明地區環境負載力較低，促使地處於古文明的殖民地發展較為遲緩\n"
 )
 
-def _init_gemini():
-    load_dotenv()
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError('請設定GEMINI_API_KEY環境變數')
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash-lite')
-
-
-def _load_curriculum() -> List[str]:
-    path = '高中必修社會課綱.csv'
-    if not os.path.exists(path):
-        return []
-    try:
-        entries: List[str] = []
-        with open(path, 'r', encoding='utf-8') as f:
-            for raw in f:
-                raw = raw.strip()
-                if not raw:
-                    continue
-                parts = [p.strip() for p in raw.split(',')]
-                for p in parts:
-                    if p:
-                        entries.append(p)
-        return entries
-    except Exception:
-        return []
-
-
-def _build_prompt(curr_items: List[str], num_questions: int) -> str:
-    items_text = '\n'.join([f"- {it}" for it in curr_items])
-    return (
+_curriculum = LazyResource('curriculum', load_curriculum)
+
+
+SOCIAL_TEMPLATE = register_template(PromptTemplate(
+    'social',
+    prefix=(
         "你是社會科測驗命題者，你的任務是為台灣大學學測（GSAT）設計風格多元的社會科單選題目，題目必須學測大考中心的宗旨和難度出題並提供答案和解析，並且加入時事題以及素養題等活用元素，一個題目只能包含題目文本、選項、解答、解析。不要出需要看圖片的題目、也不要在選項中寫出很好判斷的答案，每一個題目都要有中高等級以上的難度，並且有多元的題型變化。每一題都只有四個選項而且正確答案的選項位置是隨機分布無規律，每個選項都要有足夠的鑑別度，請絕對要參考學測題目，課綱內容應該是題目背後要考的意涵，不要出現在選項中，正確選項只能有一個。\n"
-        "以下為本次我希望測驗的課綱：\n"
-        f"{items_text}\n\n"
         "以下為學測社會題型參考（請模仿風格但不要複製，也不要把這些例題出現在輸出中）：\n"
         f"{SOCIAL_EXAMPLES}\n"
-        "請你依照上述課綱，產生"
-        f"{num_questions}"
-        "題社會科單選題，並以JSON陣列輸出。每個元素需為：{\"題目\": string, \"選項\": {\"A\": string, \"B\": string, \"C\": string, \"D\": string}, \"答案\": \"A/B/C/D\", \"解析\": string}。不要輸出任何多餘文字或代碼框。"
-    )
+        "請以JSON陣列輸出。每個元素需為：{\"題目\": string, \"選項\": {\"A\": string, \"B\": string, \"C\": string, \"D\": string}, \"答案\": \"A/B/C/D\", \"解析\": string}。不要輸出任何多餘文字或代碼框。\n\n"
+    ),
+    suffix="以下為本次我希望測驗的課綱：\n{items}\n\n請你依照上述課綱，產生{count}題社會科單選題。",
+))
+
+
+def _build_prompt(curr_items: List[str], num_questions: int) -> RenderedPrompt:
+    items_text = '\n'.join([f"- {it}" for it in curr_items])
+    return SOCIAL_TEMPLATE.render(items=items_text, count=num_questions)
 
 
 def _parse_model_json(text: str) -> List[Dict]:
-    content = text.strip()
-    if content.startswith('```json'):
-        content = content[7:-3]
-    elif content.startswith('```'):
-        content = content[3:-3]
-    data = json.loads(content)
-    if isinstance(data, dict):
-        return [data]
-    if isinstance(data, list):
-        return data
-    return []
+    questions, invalid = parse_questions(text, explanation_key='解析')
+    if invalid:
+        print(f"模型輸出有 {invalid} 題格式錯誤，已略過")
+    return questions
+
+
+async def _generate_questions(curr_items: List[str], count: int, timeout: Optional[float] = None) -> List[Dict]:
+    async def request(slots: List[int], time_left: float) -> List[Dict]:
+        text = await get_client().generate(
+            _build_prompt(curr_items, len(slots)), timeout=time_left, subject='social', command='choice'
+        )
+        return _parse_model_json(text)
+
+    # 每個名額對應一題，不足或不合格的名額才會再請求
+    return await generate_with_backfill(
+        list(range(count)),
+        request,
+        lambda q: not question_problems(q, explanation_key='解析'),
+        lambda q, remaining: remaining[0],
+        budget=generation_budget(timeout),
+    )
 
 
 def _create_question_embed(q: Dict, idx: int, total: int) -> discord.Embed:
@@ -126,97 +124,133 @@ def _create_result_embed(q: Dict, user_answer: str, is_correct: bool, idx: int,
                 embed.add_field(name=f"({key})", value=str(options[key]), inline=False)
     expl = q.get('解析', '')
     if expl:
-        embed.add_field(name="解析", value=str(expl), inline=False)
+        add_long_field(embed, "解析", str(expl))
     return embed
 
 
 class SocialState:
-    def __init__(self, user_id: int, questions: List[Dict]):
+    __slots__ = ('user_id', 'subject', 'questions', 'total', 'index', 'score')
+
+    def __init__(self, user_id: int, questions: List[Dict], subject: Optional[str] = None):
         self.user_id = user_id
+        self.subject = subject
         self.questions = questions
         self.total = len(questions)
         self.index = 0
         self.score = 0
 
 
-social_games: Dict[int, SocialState] = {}
+social_games = create_store('social')
+active_sessions.set_function(lambda: len(social_games), subject='social')
+
+
+def _bank_questions(subject: Optional[str], questions: List[Dict]):
+    bank = get_bank()
+    bank.submit(bank.add, 'social', subject or '', list(questions))
+
+
+# 沒被接手的預先生成題目仍存入題庫，額度不會白費
+social_prefetch = Prefetcher('social', on_unused=_bank_questions)
+
+
+async def _prefetch_questions(subject: Optional[str], count: int) -> List[Dict]:
+    items = [str(item) for item in _curriculum.get().sample(5, subject)]
+    return await _generate_questions(items, count, timeout=PREFETCH_TIMEOUT)
+
+
+def _prefetch_next(state: SocialState):
+    # 接近測驗尾聲時在背景準備同科別的下一份測驗
+    if not _curriculum.get().has_subject(state.subject):
+        return
+    subject, count = state.subject, state.total
+    social_prefetch.start(state.user_id, subject, lambda: _prefetch_questions(subject, count))
 
 
 class SocialQuizView(discord.ui.View):
     def __init__(self, state: SocialState):
         super().__init__(timeout=180)
         self.state = state
+        self.answered = False
+        self._show_question()
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.state.user_id:
+            await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+            return False
+        return True
+
+    def _add_button(self, label: str, style: discord.ButtonStyle, callback=None, name: str = ''):
+        btn = discord.ui.Button(label=label, style=style, disabled=callback is None)
+        if callback is not None:
+            btn.callback = button_latency.wrap(callback, view='social', button=name)
+        self.add_item(btn)
+
+    def _show_question(self) -> discord.Embed:
+        # 整份測驗共用同一則訊息與 View，換題時就地編輯
+        self.answered = False
+        self.clear_items()
         q = self.state.questions[self.state.index]
         options = q.get('選項', {})
         for key in ['A', 'B', 'C', 'D']:
             if key in options:
-                btn = discord.ui.Button(label=f"({key})", style=discord.ButtonStyle.primary)
-                btn.callback = self._make_cb(key)
-                self.add_item(btn)
-        stop_btn = discord.ui.Button(label="停止測驗", style=discord.ButtonStyle.danger)
-        stop_btn.callback = self._stop_cb
-        self.add_item(stop_btn)
+                self._add_button(f"({key})", discord.ButtonStyle.primary, self._make_cb(key), 'answer')
+        self._add_button("停止測驗", discord.ButtonStyle.danger, self._stop_cb, 'stop')
+        if self.state.total - (self.state.index + 1) < PREFETCH_AHEAD:
+            _prefetch_next(self.state)
+        return _create_question_embed(q, self.state.index + 1, self.state.total)
 
     def _make_cb(self, answer_key: str):
         async def _cb(interaction: discord.Interaction):
-            if interaction.user.id != self.state.user_id:
-                await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+            if self.answered:
+                await interaction.response.defer()
                 return
+            self.answered = True
             q = self.state.questions[self.state.index]
             correct = str(q.get('答案', '')).strip()
             is_correct = (answer_key.strip() == correct)
             if is_correct:
                 self.state.score += 1
-            result_view = discord.ui.View(timeout=180)
-            for item in self.children:
-                if isinstance(item, discord.ui.Button) and item.label.startswith("("):
-                    result_view.add_item(discord.ui.Button(label=item.label, style=item.style, disabled=True))
             is_last = (self.state.index + 1 >= self.state.total)
+            self.clear_items()
+            options = q.get('選項', {})
+            for key in ['A', 'B', 'C', 'D']:
+                if key in options:
+                    self._add_button(f"({key})", discord.ButtonStyle.primary)
             if not is_last:
-                next_btn = discord.ui.Button(label="下一題", style=discord.ButtonStyle.success)
-                async def _next(interaction: discord.Interaction):
-                    if interaction.user.id != self.state.user_id:
-                        await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
-                        return
-                    next_btn.disabled = True
-                    await interaction.response.edit_message(view=result_view)
-                    self.state.index += 1
-                    if self.state.index < self.state.total:
-                        nq = self.state.questions[self.state.index]
-                        embed = _create_question_embed(nq, self.state.index + 1, self.state.total)
-                        view = SocialQuizView(self.state)
-                        await interaction.followup.send(embed=embed, view=view)
-                    else:
-                        social_games.pop(self.state.user_id, None)
-                next_btn.callback = _next
-                result_view.add_item(next_btn)
+                social_games.touch(self.state.user_id)
+                self._add_button("下一題", discord.ButtonStyle.success, self._next_cb, 'next')
             else:
-                done_btn = discord.ui.Button(label="測驗完成", style=discord.ButtonStyle.danger, disabled=True)
-                result_view.add_item(done_btn)
-                social_games.pop(self.state.user_id, None)
+                self._add_button("測驗完成", discord.ButtonStyle.danger)
+                social_games.release(self.state.user_id, self.state)
+                self.stop()
             embed = _create_result_embed(q, answer_key, is_correct, self.state.index + 1, self.state.total)
-            await interaction.response.edit_message(embed=embed, view=result_view)
+            await interaction.response.edit_message(embed=embed, view=self)
         return _cb
 
-    async def _stop_cb(self, interaction: discord.Interaction):
-        if interaction.user.id != self.state.user_id:
-            await interaction.response.send_message("這不是你的測驗！", ephemeral=True)
+    async def _next_cb(self, interaction: discord.Interaction):
+        if not self.answered:
+            await interaction.response.defer()
             return
-        social_games.pop(self.state.user_id, None)
+        self.state.index += 1
+        await interaction.response.edit_message(embed=self._show_question(), view=self)
+
+    async def _stop_cb(self, interaction: discord.Interaction):
+        social_games.release(self.state.user_id, self.state)
+        social_prefetch.cancel(self.state.user_id)
+        self.stop()
         for item in self.children:
             item.disabled = True
         stop_embed = discord.Embed(title="測驗已停止", description="測驗已被用戶停止。", color=0xe74c3c)
         await interaction.response.edit_message(embed=stop_embed, view=self)
 
     async def on_timeout(self):
-        social_games.pop(self.state.user_id, None)
+        social_games.release(self.state.user_id, self.state)
+        social_prefetch.cancel(self.state.user_id)
 
 
 class Social(app_commands.Group):
     def __init__(self):
         super().__init__(name="social", description="社會科")
-        self._model = _init_gemini()
-        self._curriculum = _load_curriculum()
 
     @app_commands.command(name="choice", description="開始社會科單選題測驗")
     @app_commands.describe(subject="選擇社會科別：歷史/地理/公民")
@@ -232,44 +266,91 @@ class Social(app_commands.Group):
         if interaction.user.id in social_games:
             await interaction.response.send_message("你已經有一個進行中的社會科測驗！", ephemeral=True)
             return
-        if not self._curriculum:
+        started = time.perf_counter()
+        curriculum = _curriculum.get()
+        if not curriculum:
             await interaction.response.send_message("找不到課綱資料檔案：高中必修社會課綱.csv", ephemeral=True)
             return
-        lines = self._curriculum
-        if subject:
-            lines = [ln for ln in lines if ln.startswith(subject)]
-            if not lines:
-                await interaction.response.send_message("此科別的課綱資料為空，請改選其他科別或移除限制。", ephemeral=True)
+        if not curriculum.has_subject(subject):
+            await interaction.response.send_message("此科別的課綱資料為空，請改選其他科別或移除限制。", ephemeral=True)
+            return
+        # 上一份測驗結尾時預先生成的題目優先使用，不足的再從題庫補
+        prefetched = await social_prefetch.take(
+            interaction.user.id, subject, min(PREFETCH_TAKE_TIMEOUT, interaction_timeout(interaction)),
+            on_wait=lambda: send_status(interaction, "正在準備題目，請稍候..."),
+        )
+        if prefetched:
+            _bank_questions(subject, prefetched)
+        bank = get_bank()
+        banked = prefetched[:questions]
+        # 只取這位使用者沒做過的題目，題庫不夠新時其餘改為生成
+        try:
+            banked += await bank.call(bank.sample, 'social', questions - len(banked), scope=subject, user_id=interaction.user.id)
+        except Exception as e:
+            # 題庫暫時無法讀取（例如離線建置正在寫入）時改為生成
+            print(f"讀取題庫時發生錯誤: {e}")
+        if len(banked) >= questions:
+            state = SocialState(interaction.user.id, banked, subject)
+            try:
+                await social_games.claim(interaction.user.id, state, shard_for(interaction))
+            except SessionRejected as e:
+                await send_rejection(interaction, str(e))
                 return
-        sample_items = random.sample(lines, k=min(5, len(lines)))
-        prompt = _build_prompt(sample_items, questions)
-        if not interaction.response.is_done():
-            subject_map = {"歷": "歷史", "地": "地理", "公": "公民"}
-            subject_text = subject_map.get(subject, None) if subject else None
-            if subject_text:
-                await interaction.response.send_message(f"正在生成{subject_text}科題目，請稍候...")
+            mark_seen(interaction.user.id, banked)
+            embed = _create_question_embed(banked[0], 1, state.total)
+            view = SocialQuizView(state)
+            if interaction.response.is_done():
+                await interaction.edit_original_response(content="", embed=embed, view=view)
             else:
-                await interaction.response.send_message("正在生成社會科題目，請稍候...")
+                await interaction.response.send_message(embed=embed, view=view)
+            first_question_latency.observe(
+                time.perf_counter() - started, command='social', source='prefetch' if prefetched else 'bank'
+            )
+            return
+        subject_text = SUBJECT_NAMES.get(subject) if subject else None
+        status = f"正在生成{subject_text}科題目，請稍候..." if subject_text else "正在生成社會科題目，請稍候..."
         try:
-            resp = self._model.generate_content(prompt)
-            data = _parse_model_json(resp.text)
+            await admit(interaction)
+        except RateLimited as e:
+            await send_rejection(interaction, str(e))
+            return
+        await send_status(interaction, status)
+        try:
+            # 依主題輪替抽取課綱條目，避免連續幾次測驗都落在同一單元
+            sample_items = [str(item) for item in curriculum.sample(5, subject)]
+            data = await _generate_questions(sample_items, questions - len(banked), timeout=interaction_timeout(interaction))
             if not data:
                 await interaction.edit_original_response(content="生成題目時發生錯誤，請稍後再試。")
                 return
-            quiz_questions = data[:questions]
-            state = SocialState(interaction.user.id, quiz_questions)
-            social_games[interaction.user.id] = state
+            _bank_questions(subject, data)
+            quiz_questions = banked + data
+            state = SocialState(interaction.user.id, quiz_questions, subject)
+            try:
+                await social_games.claim(interaction.user.id, state, shard_for(interaction))
+            except SessionRejected as e:
+                await interaction.edit_original_response(content=str(e))
+                return
+            mark_seen(interaction.user.id, quiz_questions)
             first = quiz_questions[0]
             embed = _create_question_embed(first, 1, state.total)
             view = SocialQuizView(state)
-            await interaction.edit_original_response(content="", embed=embed, view=view)
-        except json.JSONDecodeError as e:
-            await interaction.edit_original_response(content=f"模型輸出非合法JSON：{e}")
+            notice = f"僅成功生成 {state.total} 題。" if state.total < questions else ""
+            await interaction.edit_original_response(content=notice, embed=embed, view=view)
+            first_question_latency.observe(time.perf_counter() - started, command='social', source='generated')
+        except asyncio.TimeoutError:
+            await interaction.edit_original_response(content="生成題目逾時，請稍後再試。")
         except Exception as e:
             await interaction.edit_original_response(content=f"產生題目時發生錯誤：{e}")
 
 
+async def warm_up():
+    await _curriculum.load_async()
+    get_client()
+    social_games.start_sweeper()
+
+
 def register(bot: commands.Bot):
     bot.tree.add_command(Social())
+    register_warmup('social', warm_up)
 
 
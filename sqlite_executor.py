@@ -0,0 +1,36 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Set
+
+
+class SQLiteExecutor:
+    def __init__(self, name: str, error_message: str):
+        # 每個資料庫只用一條背景執行緒依序處理查詢與寫入，不阻塞事件迴圈，也保證寫入與下一次讀取的先後順序
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._error_message = error_message
+        # 保留尚未完成的寫入，避免事件迴圈只持有弱參照時被回收
+        self._pending: Set[asyncio.Future] = set()
+
+    async def call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def submit(self, func, *args, **kwargs):
+        # 寫入不需要等結果，送到背景執行緒後立即返回；沒有事件迴圈時直接執行
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args, **kwargs)
+            return
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: asyncio.Future):
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"{self._error_message}: {future.exception()}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
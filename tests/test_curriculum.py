@@ -0,0 +1,37 @@
+import csv
+import os
+
+from curriculum import EXTENSION_TAG, parse_curriculum
+
+
+CURRICULUM_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '高中必修社會課綱.csv')
+
+
+def test_extension_cell_attaches_to_previous_item_in_column():
+    items = parse_curriculum([
+        ['歷 A-V-1 誰的歷史？', '公 Aa-V-1 公民身分如何演變？'],
+        ['', f'{EXTENSION_TAG}原住民族的公民身分有什麼意義？'],
+    ])
+    assert [(i.subject, i.code, i.extension) for i in items] == [
+        ('歷', 'A-V-1', False), ('公', 'Aa-V-1', False), ('公', 'Aa-V-1', True),
+    ]
+    assert items[2].text == '原住民族的公民身分有什麼意義？'
+
+
+def test_extension_marker_inside_item_cell_is_split_out():
+    items = parse_curriculum([['公 Bc-V-1 社會規範如何維護社會秩序？ 【延伸探究】規範何時會受到質疑？']])
+    assert [(i.code, i.text, i.extension) for i in items] == [
+        ('Bc-V-1', '社會規範如何維護社會秩序？', False),
+        ('Bc-V-1', '規範何時會受到質疑？', True),
+    ]
+
+
+def test_bc_v_2_row_is_an_extension_not_a_learning_item():
+    with open(CURRICULUM_PATH, 'r', encoding='utf-8', newline='') as f:
+        row = list(csv.reader(f))[15]
+    items = parse_curriculum([row])
+    bc = [i for i in items if i.code == 'Bc-V-2']
+    assert len(bc) == 1
+    assert bc[0].extension
+    assert bc[0].text.startswith('社會規範對個人追求自我實現')
+    assert all(EXTENSION_TAG not in i.text for i in items)
@@ -0,0 +1,46 @@
+import pytest
+
+from word_forms import contains_form, word_forms
+
+
+@pytest.mark.parametrize('word, form', [
+    ('blur', 'blurring'),
+    ('hope', 'hoping'),
+    ('hop', 'hopped'),
+    ('die', 'dying'),
+    ('study', 'studies'),
+    ('leaf', 'leaves'),
+    ('knife', 'knives'),
+    ('bus', 'buses'),
+    ('go', 'went'),
+    ('buy', 'bought'),
+    ('child', 'children'),
+])
+def test_inflections_match(word, form):
+    assert form in word_forms(word)
+
+
+@pytest.mark.parametrize('word, form', [
+    # 衍生字不算同一個單字
+    ('state', 'station'),
+    ('rate', 'ration'),
+    ('admire', 'admiration'),
+    ('noise', 'noisy'),
+    ('man', 'manly'),
+    ('simple', 'simply'),
+    ('basic', 'basically'),
+    # 字尾變化不能跨到另一個單字
+    ('hope', 'hopping'),
+])
+def test_derived_and_unrelated_words_do_not_match(word, form):
+    assert form not in word_forms(word)
+
+
+def test_contains_form_matches_whole_tokens():
+    assert not contains_form('It is important.', word_forms('ant'))
+    assert contains_form('Two ants.', word_forms('ant'))
+    assert contains_form('She went home.', word_forms('go'))
+
+
+def test_phrases_only_match_as_written():
+    assert word_forms('look after') == frozenset({'look after'})
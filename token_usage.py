@@ -0,0 +1,38 @@
+from typing import Dict, List, Tuple
+
+
+class TokenUsage:
+    def __init__(self):
+        self._totals: Dict[Tuple[str, str], List[int]] = {}
+
+    def record(self, subject: str, command: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0):
+        totals = self._totals.setdefault((subject, command), [0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += input_tokens
+        totals[2] += output_tokens
+        totals[3] += cached_tokens
+
+    def record_response(self, subject: str, command: str, response):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        self.record(
+            subject,
+            command,
+            getattr(usage, 'prompt_token_count', 0) or 0,
+            getattr(usage, 'candidates_token_count', 0) or 0,
+            getattr(usage, 'cached_content_token_count', 0) or 0,
+        )
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        return {
+            key: {'calls': t[0], 'input': t[1], 'output': t[2], 'cached': t[3]}
+            for key, t in self._totals.items()
+        }
+
+    def top(self, n: int = 5) -> List[Tuple[Tuple[str, str], Dict[str, int]]]:
+        snap = self.snapshot()
+        return sorted(snap.items(), key=lambda kv: kv[1]['input'] + kv[1]['output'], reverse=True)[:n]
+
+
+token_usage = TokenUsage()
@@ -0,0 +1,133 @@
+import csv
+import random
+import re
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from word_forms import word_forms
+
+
+# 'knowledge n. lake' 這類列是兩個單字被合併在一起，以詞性標記切開
+_POS_TAG = re.compile(r'\s+(?:n|v|adj|adv|prep|conj|pron|art|aux|int)\.\s+')
+_PARENTHETICAL = re.compile(r'\s*\(([^)]*)\)')
+
+
+class WordEntry:
+    __slots__ = ('level', 'variants', 'meanings', 'extras')
+
+    def __init__(self, level: int, variants: Tuple[str, ...], meanings: Tuple[str, ...], extras: Tuple[str, ...] = ()):
+        self.level = level
+        self.variants = variants
+        self.meanings = meanings
+        # 括號內的衍生字或代名詞變化，例如 enjoy(ment)、he (him, his, himself)
+        self.extras = extras
+
+    def pick(self) -> Tuple[str, str]:
+        # actor/actress 這類條目隨機取其中一個拼法，並取對應的中文
+        i = random.randrange(len(self.variants))
+        meaning = self.meanings[i] if i < len(self.meanings) else (self.meanings[0] if self.meanings else '')
+        return self.variants[i], meaning
+
+
+class VocabularyStore:
+    def __init__(self, entries: Sequence[WordEntry]):
+        self.entries: Tuple[WordEntry, ...] = tuple(entries)
+        by_level: Dict[int, List[WordEntry]] = {}
+        for entry in self.entries:
+            by_level.setdefault(entry.level, []).append(entry)
+        self.by_level: Dict[int, Tuple[WordEntry, ...]] = {lv: tuple(items) for lv, items in by_level.items()}
+        self._word_levels: Dict[str, int] = {}
+        self._extras: Dict[str, Tuple[str, ...]] = {}
+        for entry in self.entries:
+            for variant in entry.variants:
+                self._word_levels.setdefault(variant.lower(), entry.level)
+                if entry.extras:
+                    self._extras[variant.lower()] = entry.extras
+            for extra in entry.extras:
+                self._word_levels.setdefault(extra.lower(), entry.level)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def empty(self) -> bool:
+        return not self.entries
+
+    def level_of(self, word: str) -> Optional[int]:
+        return self._word_levels.get(word.strip().lower())
+
+    def forms_of(self, word: str) -> FrozenSet[str]:
+        key = word.strip().lower()
+        extras = self._extras.get(key)
+        if not extras:
+            return word_forms(key)
+        # 括號內的衍生字只接受原本的拼法，代名詞套用字尾規則容易誤判
+        return word_forms(key) | {extra.lower() for extra in extras}
+
+    def sample(self, count: int, level: Optional[int] = None) -> List[WordEntry]:
+        population = self.by_level.get(level, ()) if level else self.entries
+        if not population:
+            return []
+        return random.sample(population, min(count, len(population)))
+
+
+def _clean_meaning(meaning: str) -> str:
+    # 中文欄常殘留括號內容或不成對的右括號，例如「享受）」「他（他，他的）」
+    return meaning.split('（', 1)[0].replace('）', '').strip()
+
+
+def _split_variant(text: str) -> Tuple[str, List[str]]:
+    extras: List[str] = []
+    for match in _PARENTHETICAL.finditer(text):
+        inner = match.group(1).strip()
+        base = text[:match.start()].strip()
+        for part in inner.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            # enjoy(ment) 是字尾，argue(argument) 與 he (him, his) 則是完整單字
+            extras.append(part if ',' in inner or part.lower().startswith(base.lower()[:3]) else base + part)
+    return _PARENTHETICAL.sub('', text).strip(), extras
+
+
+def parse_word(raw: str, meaning: str) -> List[WordEntry]:
+    parts = _POS_TAG.split(raw.strip())
+    merged = len(parts) > 1
+    meanings = [_clean_meaning(m) for m in meaning.split('/')]
+    entries: List[WordEntry] = []
+    for part in parts:
+        variants: List[str] = []
+        kept_meanings: List[str] = []
+        extras: List[str] = []
+        raw_variants = [v.strip() for v in part.split('/') if v.strip()]
+        for i, text in enumerate(raw_variants):
+            variant, found = _split_variant(text)
+            # caf./cafe 這類拼法是重音字母遺失後的殘缺寫法，有完整拼法時略過
+            if variant.endswith('.') and any(
+                other != text and other.lower().startswith(variant[:-1].lower()) for other in raw_variants
+            ):
+                continue
+            variants.append(variant)
+            kept_meanings.append(meanings[i] if i < len(meanings) else '')
+            extras.extend(found)
+        if not variants:
+            continue
+        # 合併列的中文無法拆開，只保留單字供生成使用
+        entries.append(WordEntry(0, tuple(variants), () if merged else tuple(kept_meanings), tuple(extras)))
+    return entries
+
+
+def load_vocabulary(path: str = '學測6000字.csv') -> VocabularyStore:
+    entries: List[WordEntry] = []
+    try:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                word = (row.get('單字') or '').strip()
+                level = (row.get('級別') or '').strip()
+                if not word or not level:
+                    continue
+                for entry in parse_word(word, row.get('中文') or ''):
+                    entry.level = int(float(level))
+                    entries.append(entry)
+    except Exception as e:
+        print(f"載入單字資料時發生錯誤: {e}")
+    return VocabularyStore(entries)
@@ -0,0 +1,139 @@
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Set
+
+
+# 學測常見的不規則變化：原形 變化形（有多種寫法時以 | 分隔）；其餘單字只套用規則變化
+_IRREGULAR = """
+be was|were|is|are|am|been
+begin began|begun
+break broke|broken
+bring brought
+build built
+buy bought
+catch caught
+child children
+choose chose|chosen
+come came
+do did|done|does
+drive drove|driven
+eat ate|eaten
+fall fell|fallen
+feel felt
+fight fought
+find found
+fly flew|flown|flies
+foot feet
+forget forgot|forgotten
+get got|gotten
+give gave|given
+go went|gone|goes
+good better|best
+bad worse|worst
+have has|had
+hold held
+keep kept
+know knew|known
+leave left
+lose lost
+make made
+man men
+mean meant
+meet met
+mouse mice
+person people
+pay paid
+say said
+see saw|seen
+seek sought
+sell sold
+send sent
+sing sang|sung
+sit sat
+speak spoke|spoken
+spend spent
+stand stood
+steal stole|stolen
+swim swam|swum
+take took|taken
+teach taught
+tell told
+think thought
+tooth teeth
+throw threw|thrown
+understand understood
+wear wore|worn
+win won
+woman women
+write wrote|written
+"""
+
+
+def _table(text: str) -> Dict[str, FrozenSet[str]]:
+    table: Dict[str, FrozenSet[str]] = {}
+    for line in text.strip().splitlines():
+        base, forms = line.split()
+        table[base] = frozenset(forms.split('|'))
+    return table
+
+
+IRREGULAR = _table(_IRREGULAR)
+_VOWELS = set('aeiou')
+
+
+def _doubles_final(word: str) -> bool:
+    # 子音＋短母音＋子音結尾（sit、stop、begin）加字尾時重複最後一個字母
+    return (
+        len(word) >= 3
+        and word[-1] not in _VOWELS and word[-1] not in 'wxy'
+        and word[-2] in _VOWELS
+        and word[-3] not in _VOWELS
+    )
+
+
+def regular_forms(word: str) -> Set[str]:
+    # 只產生規則的屈折變化（複數、第三人稱、過去式、進行式、比較級），不猜衍生字
+    forms = {word, word + 's', word + 'es', word + 'ed', word + 'ing'}
+    if len(word) <= 2:
+        return forms
+    forms |= {word + 'er', word + 'est'}
+    if word.endswith('e'):
+        forms |= {word[:-1] + 'ing', word + 'd', word + 'r', word + 'st'}
+        if word.endswith('ie'):
+            forms.add(word[:-2] + 'ying')
+    if word[-1] == 'y' and word[-2] not in _VOWELS:
+        stem = word[:-1]
+        forms |= {stem + 'ies', stem + 'ied', stem + 'ier', stem + 'iest'}
+    if _doubles_final(word):
+        last = word[-1]
+        forms |= {word + last + 'ing', word + last + 'ed', word + last + 'er', word + last + 'est'}
+    if word.endswith('fe'):
+        forms.add(word[:-2] + 'ves')
+    elif word.endswith('f'):
+        forms.add(word[:-1] + 'ves')
+    return forms
+
+
+@lru_cache(maxsize=20000)
+def word_forms(word: str) -> FrozenSet[str]:
+    word = word.strip().lower().replace('’', "'")
+    if not word:
+        return frozenset()
+    if ' ' in word or '.' in word:
+        # 片語與縮寫只比對原本的寫法
+        return frozenset({word})
+    return frozenset(regular_forms(word) | IRREGULAR.get(word, frozenset()))
+
+
+@lru_cache(maxsize=20000)
+def forms_pattern(forms: FrozenSet[str]) -> 're.Pattern':
+    # 以完整單字比對，避免 ant 被 important 誤判為包含
+    alternatives = '|'.join(sorted((re.escape(f) for f in forms), key=len, reverse=True))
+    return re.compile(rf"(?<![a-z])(?:{alternatives})(?![a-z])")
+
+
+def contains_form(text: str, forms: Iterable[str]) -> bool:
+    forms = frozenset(forms)
+    if not forms:
+        return False
+    return forms_pattern(forms).search(text.lower().replace('’', "'")) is not None